@@ -0,0 +1,76 @@
+# -*- coding:utf-8 -*-
+# 原始数据存档
+import os
+import gzip
+import json
+import hashlib
+import threading
+import settings
+
+
+class RawArchive(object):
+    """
+    原始数据存档
+    数据按内容的sha256压缩保存，相同的内容只保存一份，
+    index.jsonl 记录每个交易所每天每个品种对应的内容
+    """
+    def __init__(self, exchange, root=None):
+        self.exchange = exchange
+        # 存档目录
+        self.root = os.path.join(root or settings.ARCHIVE_DIR, exchange)
+        # 索引文件
+        self.index_path = os.path.join(self.root, 'index.jsonl')
+        self._lock = threading.Lock()
+
+    def object_path(self, digest):
+        """内容的保存路径"""
+        return os.path.join(self.root, 'objects', digest[:2], '%s.gz' % digest)
+
+    def save(self, day, product, content):
+        """
+        保存原始数据
+        :param day: 日期
+        :param product: 品种，没有区分品种的使用 all
+        :param content: 原始数据 bytes
+        """
+        digest = hashlib.sha256(content).hexdigest()
+        path = self.object_path(digest)
+        if not os.path.isfile(path):
+            dir_name = os.path.dirname(path)
+            if not os.path.isdir(dir_name):
+                os.makedirs(dir_name, exist_ok=True)
+            # 先写临时文件再替换，避免留下不完整的文件
+            temp_path = '%s.%s.%s' % (path, os.getpid(), threading.get_ident())
+            with gzip.open(temp_path, 'wb') as f:
+                f.write(content)
+            os.replace(temp_path, path)
+        entry = {
+            'date': day.strftime('%Y%m%d'),
+            'product': product,
+            'sha256': digest,
+            'size': len(content),
+        }
+        with self._lock:
+            with open(self.index_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + '\n')
+
+    def entries(self):
+        """
+        按日期、品种排序返回所有存档记录，同一天同一品种以最后保存的为准
+        """
+        if not os.path.isfile(self.index_path):
+            return []
+        entries = {}
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                entry = json.loads(line)
+                entries[(entry['date'], entry['product'])] = entry
+        return [entries[key] for key in sorted(entries)]
+
+    def load(self, entry):
+        """读取存档记录对应的原始数据"""
+        with gzip.open(self.object_path(entry['sha256']), 'rb') as f:
+            return f.read()
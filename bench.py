@@ -0,0 +1,368 @@
+# -*- coding:utf-8 -*-
+# 数据处理性能测试
+# 使用合成数据或原始数据存档，在不请求网络、不写数据库的情况下测试各交易所的数据处理速度
+#
+# python bench.py                    使用合成数据测试全部交易所
+# python bench.py --exchange czce    只测试郑商所
+# python bench.py --archive 20       使用存档中每个交易所最近20天的数据测试
+# python bench.py --save             把结果保存为基准
+# python bench.py --compare          与保存的基准对比，变慢超过阈值时返回非0
+# python bench.py --verify           验证郑商所快速转换与DataFrame转换的结果一致
+import io
+import os
+import sys
+import json
+import time
+import random
+import zipfile
+import argparse
+import datetime
+import tracemalloc
+
+from queue import Queue
+from pipeline import Collector
+
+# 基准结果文件
+BASELINE_FILE = './temp/bench_baseline.json'
+
+# 生成合成数据使用的会员名称
+NAMES = ['银河期货', '永安期货', '方正中期', '中信期货', '国泰君安', '海通期货', '东海期货', '华泰期货', '申万期货', '东证期货',
+         '浙商期货', '中财期货', '光大期货', '中信建投', '中辉期货', '南华期货', '国投安信', '徽商期货', '信达期货', '兴证期货']
+
+
+def rank_rows(rnd, size=20):
+    """生成一个排名表的数据 (rank, name, volume, volumeDiff)"""
+    names = rnd.sample(NAMES, len(NAMES))
+    return [(i + 1, names[i % len(names)], rnd.randint(100, 100000), rnd.randint(-5000, 5000)) for i in range(size)]
+
+
+def contracts(day, rnd, goods_list, count):
+    """生成当年及下一年交割的合约代码"""
+    result = []
+    for goods in goods_list:
+        for i in range(count):
+            result.append('%s%02d%02d' % (goods, (day.year + rnd.randint(0, 1)) % 100, i * 2 + 1))
+    return result
+
+
+def shfe_payload(day, rnd):
+    """上期所 json 数据"""
+    rows = []
+    for contract in contracts(day, rnd, ['cu', 'al', 'zn', 'rb', 'ru', 'au'], 6):
+        tables = [rank_rows(rnd) for _ in range(3)]
+        for r in range(20):
+            row = {'INSTRUMENTID': contract + '  ', 'RANK': r + 1}
+            for i, table in enumerate(tables):
+                rank, name, volume, diff = table[r]
+                row['PARTICIPANTABBR%s' % (i + 1)] = name + ' '
+                row['CJ%s' % (i + 1)] = volume
+                row['CJ%s_CHG' % (i + 1)] = diff
+            rows.append(row)
+        summary = {'INSTRUMENTID': contract, 'RANK': 999}
+        for i, table in enumerate(tables):
+            summary['PARTICIPANTABBR%s' % (i + 1)] = ''
+            summary['CJ%s' % (i + 1)] = sum(t[2] for t in table)
+            summary['CJ%s_CHG' % (i + 1)] = sum(t[3] for t in table)
+        rows.append(summary)
+        # 品种的总情况
+        rows.append(dict(summary, RANK=0))
+    data = {'o_cursor': rows, 'report_date': day.strftime('%Y%m%d')}
+    return {'all': json.dumps(data, ensure_ascii=False).encode('utf-8')}
+
+
+def czce_tables(day, rnd):
+    """郑商所每个合约的三个排名表及合计"""
+    for contract in contracts(day, rnd, ['CF', 'SR', 'TA', 'MA', 'RM'], 6):
+        goods = contract[:2]
+        # 郑商所合约使用3个数字
+        contract = goods + contract[3:]
+        tables = [rank_rows(rnd) for _ in range(3)]
+        rows = []
+        for r in range(20):
+            row = [str(tables[0][r][0])]
+            for table in tables:
+                rank, name, volume, diff = table[r]
+                # 部分排名没有数据
+                if r >= 18:
+                    row += ['-', '-', '-']
+                else:
+                    row += [name, '{:,}'.format(volume), '{:,}'.format(diff)]
+            rows.append(row)
+        totals = [('{:,}'.format(sum(t[2] for t in table[:18])), '{:,}'.format(sum(t[3] for t in table[:18]))) for table in tables]
+        yield goods, contract, rows, totals
+
+
+def czce_payload1(day, rnd, total_size=9):
+    """郑商所 2010-08-24 及以前的网页"""
+    html = ['<html><body>']
+    for goods, contract, rows, totals in czce_tables(day, rnd):
+        html.append("<div align='left'><b><font>品种：%s 日期:%s</font></b></div><table><tr><td>品种</td></tr></table>" % (goods, day.strftime('%Y%m%d')))
+        html.append("<div align='left'><b><font>合约代码:%s 日期:%s</font></b></div>" % (contract, day.strftime('%Y%m%d')))
+        html.append('<table><tr><td>名次</td><td>会员简称</td><td>成交量</td><td>增减</td></tr>')
+        for row in rows:
+            html.append('<tr>%s</tr>' % ''.join('<td>%s</td>' % i for i in row))
+        # 合计一行的tr是有问题的
+        if total_size == 6:
+            cells = ['', '', totals[0][0], totals[0][1], '', totals[1][0], totals[1][1], '', totals[2][0], totals[2][1]]
+        else:
+            cells = ['合计', totals[0][0], totals[0][1], '&nbsp;', totals[1][0], totals[1][1], '&nbsp;', totals[2][0], totals[2][1]]
+        html.append('<tr></tr></tr>%s</tr></table>' % ''.join('<td>%s</td>' % i for i in cells))
+    html.append('</body></html>')
+    return {'all': ''.join(html).encode('utf-8')}
+
+
+def czce_payload6(day, rnd):
+    """郑商所 2006-01-16 合计只有6列的网页"""
+    return czce_payload1(day, rnd, total_size=6)
+
+
+def czce_payload2(day, rnd, table_class=" class='table'"):
+    """郑商所 2010-08-25 至 2017-12-27 的网页"""
+    html = ['<html><body><table%s>' % table_class]
+    header = ['名次', '会员简称', '成交量', '增减', '会员简称', '持买仓量', '增减', '会员简称', '持卖仓量', '增减']
+    for goods, contract, rows, totals in czce_tables(day, rnd):
+        html.append('<tr><td colspan="10"><b>品种：%s 日期：%s</b></td></tr>' % (goods, day.strftime('%Y-%m-%d')))
+        html.append('<tr><td colspan="10"><b>合约：%s 日期：%s</b></td></tr>' % (contract, day.strftime('%Y-%m-%d')))
+        if table_class:
+            html.append('<tr class="tr0">%s</tr>' % ''.join('<td>%s</td>' % i for i in header))
+        else:
+            html.append('<tr>%s</tr>' % ''.join('<td>%s</td>' % i for i in header))
+        for row in rows:
+            html.append('<tr>%s</tr>' % ''.join('<td>%s</td>' % i for i in row))
+        cells = ['合计', '&nbsp;', totals[0][0], totals[0][1], '&nbsp;', totals[1][0], totals[1][1], '&nbsp;', totals[2][0], totals[2][1]]
+        html.append('<tr>%s</tr>' % ''.join('<td>%s</td>' % i for i in cells))
+    html.append('</table></body></html>')
+    return {'all': ''.join(html).encode('utf-8')}
+
+
+def czce_payload3(day, rnd):
+    """郑商所 2017-12-28 及以后的网页"""
+    return czce_payload2(day, rnd, table_class='')
+
+
+def dce_payload(day, rnd, encoding='utf-8'):
+    """大商所压缩包，encoding 为 utf-8 时使用制表符分隔，gbk 时使用空格分隔"""
+    sep = '\t' if encoding == 'utf-8' else '  '
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as z:
+        for contract in contracts(day, rnd, ['a', 'm', 'y', 'c', 'i', 'j', 'p'], 6):
+            lines = ['大连商品交易所持仓排名', '合约代码：%s%sDate：%s' % (contract, sep, day.strftime('%Y-%m-%d'))]
+            for title in ['成交量', '持买单量', '持卖单量']:
+                lines.append(sep.join(['名次', '会员简称', title, '增减']))
+                table = rank_rows(rnd, rnd.randint(20, 60))
+                for rank, name, volume, diff in table:
+                    lines.append(sep.join([str(rank), name, '{:,}'.format(volume), '{:,}'.format(diff)]))
+                lines.append(sep.join(['总计', '{:,}'.format(sum(t[2] for t in table)), '{:,}'.format(sum(t[3] for t in table))]))
+                lines.append('')
+            file_name = '%s_%s.txt' % (day.strftime('%Y%m%d'), contract)
+            z.writestr(file_name, '\n'.join(lines).encode(encoding))
+    return {'all': buffer.getvalue()}
+
+
+def dce_payload_gbk(day, rnd):
+    """大商所 gbk 编码的压缩包"""
+    return dce_payload(day, rnd, encoding='gbk')
+
+
+def cffex_payload(day, rnd):
+    """中金所 xml 数据，每个品种一份"""
+    payloads = {}
+    for goods in ['IF', 'IH', 'IC']:
+        xml = ['<?xml version="1.0" encoding="UTF-8"?><positionRank>']
+        for contract in contracts(day, rnd, [goods], 4):
+            for value in range(3):
+                for rank, name, volume, diff in rank_rows(rnd):
+                    xml.append('<data Value="%s"><instrumentId>%s</instrumentId><tradingday>%s</tradingday><datatypeid>%s</datatypeid>'
+                               '<rank>%s</rank><shortname>%s</shortname><volume>%s</volume><varVolume>%s</varVolume>'
+                               '<partyid>0001</partyid><productid>%s</productid></data>'
+                               % (value, contract, day.strftime('%Y%m%d'), value, rank, name, volume, diff, goods))
+        xml.append('</positionRank>')
+        payloads[goods] = ''.join(xml).encode('utf-8')
+    return payloads
+
+
+# 测试用例: 名称 -> (交易所, 合成数据的日期, 生成函数)
+CASES = {
+    'shfe': ('shfe', datetime.date(2019, 4, 12), shfe_payload),
+    'czce-2006': ('czce', datetime.date(2006, 1, 16), czce_payload6),
+    'czce-2010': ('czce', datetime.date(2010, 8, 24), czce_payload1),
+    'czce-2017': ('czce', datetime.date(2017, 12, 27), czce_payload2),
+    'czce-2019': ('czce', datetime.date(2019, 4, 12), czce_payload3),
+    'dce-utf8': ('dce', datetime.date(2019, 4, 12), dce_payload),
+    'dce-gbk': ('dce', datetime.date(2012, 4, 12), dce_payload_gbk),
+    'cffex': ('cffex', datetime.date(2019, 4, 12), cffex_payload),
+}
+
+
+def load_module(exchange):
+    """导入交易所模块"""
+    return __import__(exchange)
+
+
+def make_parse(exchange):
+    """
+    构造处理函数，输入 (日期, 品种, 原始数据)，返回 (成交量, 持买单量, 持卖单量) 三个文档列表
+    """
+    module = load_module(exchange)
+    crawler = module.CrawlData(Queue())
+
+    def parse(day, product, content):
+        trade_q, long_q, short_q = Collector(), Collector(), Collector()
+        parser = module.ParseData(None, trade_q, short_q, long_q)
+        item = crawler.to_item(day, product, content)
+        if item is not None:
+            parser.handle((day, product, item))
+        return trade_q.docs(), long_q.docs(), short_q.docs()
+    return parse
+
+
+def synthetic_payloads(case, days):
+    """生成合成数据 [(日期, 品种, 原始数据)]"""
+    exchange, day, generate = CASES[case]
+    rnd = random.Random(case)
+    payloads = []
+    # 从用例日期往前生成，保证都在同一个数据格式的时间段内
+    for i in range(days):
+        current = day - datetime.timedelta(days=i)
+        for product, content in sorted(generate(current, rnd).items()):
+            payloads.append((current, product, content))
+    return payloads
+
+
+def archive_payloads(exchange, days):
+    """读取存档中最近几天的数据 [(日期, 品种, 原始数据)]"""
+    from archive import RawArchive
+    archive = RawArchive(exchange)
+    entries = archive.entries()
+    dates = sorted(set(entry['date'] for entry in entries))[-days:]
+    payloads = []
+    for entry in entries:
+        if entry['date'] in dates:
+            day = datetime.datetime.strptime(entry['date'], '%Y%m%d').date()
+            payloads.append((day, entry['product'], archive.load(entry)))
+    return payloads
+
+
+def run_case(exchange, payloads, repeat):
+    """对一组数据测试处理速度及内存占用"""
+    parse = make_parse(exchange)
+    days = len(set(day for day, _, _ in payloads))
+    # 预热一次
+    docs = sum(sum(len(q) for q in parse(*payload)) for payload in payloads)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for payload in payloads:
+            parse(*payload)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    # 单独测试一次内存占用，避免 tracemalloc 影响耗时
+    tracemalloc.start()
+    for payload in payloads:
+        parse(*payload)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'days': days,
+        'docs': docs,
+        'bytes': sum(len(content) for _, _, content in payloads),
+        'seconds': best,
+        'docs_per_second': docs / best if best else 0,
+        'ms_per_day': best * 1000 / days if days else 0,
+        'peak_kb': peak / 1024,
+    }
+
+
+def verify_czce(payloads):
+    """对比郑商所 convert 与 convert_pandas 的结果，返回不一致的合约"""
+    import czce
+    mismatches = []
+
+    class Checker(czce.ParseData):
+        def parse2(self, data, info_dict):
+            if self.convert(data, info_dict) != self.convert_pandas(data, info_dict):
+                mismatches.append('%s %s' % (info_dict['symbol'], info_dict['date'].strftime('%Y-%m-%d')))
+
+    crawler = czce.CrawlData(Queue())
+    checker = Checker(None, Collector(), Collector(), Collector())
+    for day, product, content in payloads:
+        checker.parse_data(*crawler.to_item(day, product, content))
+    return mismatches
+
+
+def compare(results, baseline, threshold):
+    """与基准对比，返回变慢的用例"""
+    regressions = []
+    for case, result in sorted(results.items()):
+        base = baseline.get(case)
+        if not base or not base['ms_per_day']:
+            continue
+        ratio = result['ms_per_day'] / base['ms_per_day']
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  <-- 变慢'
+            regressions.append(case)
+        print('%-12s %10.2f ms/天  基准 %10.2f ms/天  %6.2fx%s' % (case, result['ms_per_day'], base['ms_per_day'], ratio, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='数据处理性能测试')
+    parser.add_argument('--exchange', nargs='*', default=['shfe', 'czce', 'dce', 'cffex'], help='需要测试的交易所')
+    parser.add_argument('--days', type=int, default=5, help='每个用例合成数据的天数')
+    parser.add_argument('--repeat', type=int, default=3, help='重复次数，取最快的一次')
+    parser.add_argument('--archive', type=int, default=0, help='使用存档中最近几天的数据代替合成数据')
+    parser.add_argument('--save', action='store_true', help='把结果保存为基准')
+    parser.add_argument('--compare', action='store_true', help='与保存的基准对比')
+    parser.add_argument('--threshold', type=float, default=0.2, help='变慢超过该比例视为退化')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='基准结果文件')
+    parser.add_argument('--verify', action='store_true', help='验证郑商所快速转换与DataFrame转换的结果一致')
+    args = parser.parse_args()
+
+    results = {}
+    if args.archive:
+        cases = [('%s-archive' % exchange, exchange, archive_payloads(exchange, args.archive)) for exchange in args.exchange]
+    else:
+        cases = [(case, exchange, synthetic_payloads(case, args.days)) for case, (exchange, _, _) in CASES.items() if exchange in args.exchange]
+    print('%-12s %6s %8s %10s %12s %12s %12s' % ('用例', '天数', '数据条数', '大小(KB)', '条/秒', 'ms/天', '峰值内存(KB)'))
+    for case, exchange, payloads in cases:
+        if not payloads:
+            print('%-12s 没有数据' % case)
+            continue
+        result = run_case(exchange, payloads, args.repeat)
+        results[case] = result
+        print('%-12s %6d %8d %10.1f %12.1f %12.2f %12.1f' % (
+            case, result['days'], result['docs'], result['bytes'] / 1024,
+            result['docs_per_second'], result['ms_per_day'], result['peak_kb']))
+
+    if args.verify:
+        failed = False
+        for case, exchange, payloads in cases:
+            if exchange != 'czce':
+                continue
+            mismatches = verify_czce(payloads)
+            print('%-12s %s' % (case, '结果一致' if not mismatches else '结果不一致: %s' % ', '.join(mismatches)))
+            failed = failed or bool(mismatches)
+        if failed:
+            return 1
+
+    if args.compare:
+        if not os.path.isfile(args.baseline):
+            print('没有找到基准文件 %s' % args.baseline)
+            return 1
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            return 1
+    if args.save:
+        dir_name = os.path.dirname(args.baseline)
+        if dir_name and not os.path.isdir(dir_name):
+            os.makedirs(dir_name)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print('已保存基准 %s' % args.baseline)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,80 @@
+# -*- coding:utf-8 -*-
+# 数据库连接
+# 每个进程共用一个 MongoClient，第一次使用时创建，数据表索引每次运行只创建一次
+import os
+import threading
+import pymongo
+import settings
+
+from pymongo import ReplaceOne
+
+# 当前进程的连接
+_client = None
+_client_pid = None
+# 本次运行已经创建过索引的数据表
+_indexed = set()
+_lock = threading.Lock()
+
+
+def get_client():
+    """当前进程共用的数据库连接，MongoClient 不能在 fork 出的子进程中继续使用，子进程会重新创建"""
+    global _client, _client_pid
+    with _lock:
+        if _client is None or _client_pid != os.getpid():
+            kwargs = {
+                'host': settings.MONGODB['HOST'],
+                'port': settings.MONGODB['PORT'],
+                'username': settings.MONGODB['USERNAME'],
+                'password': settings.MONGODB['PASSWORD'],
+                'authSource': settings.MONGODB['AUTHSOURCE'],
+            }
+            if settings.MONGODB['AUTHMECHANISM']:
+                kwargs['authMechanism'] = settings.MONGODB['AUTHMECHANISM']
+            _client = pymongo.MongoClient(**kwargs)
+            _client_pid = os.getpid()
+            _indexed.clear()
+        return _client
+
+
+def get_db():
+    """当前进程共用的数据库"""
+    return get_client()[settings.DB_NAME]
+
+
+def ensure_index(collection):
+    """
+    创建数据表的索引，每个数据表只创建一次
+    写入时按 (date, symbol) 查找已有数据；使用确定的 _id 时按主键写入，
+    但查找最后一天、交易日和缺少数据的日期仍然按日期查询，需要 (date, exchange) 索引
+    """
+    with _lock:
+        if collection.name in _indexed:
+            return
+        _indexed.add(collection.name)
+    if settings.DETERMINISTIC_ID:
+        collection.create_index([('date', 1), ('exchange', 1)])
+    else:
+        collection.create_index([('date', 1), ('symbol', 1)])
+
+
+def close():
+    """关闭当前进程的连接，之后再使用时重新创建"""
+    global _client
+    with _lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _indexed.clear()
+
+
+def document_id(data):
+    """由合约代码和日期生成的 _id，合约代码中已经包含交易所，例如 shfe_cu1905_20190412"""
+    return '%s_%s' % (data['symbol'], data['date'].strftime('%Y%m%d'))
+
+
+def upsert(data):
+    """写入一条数据的操作，已有同一合约同一天的数据时替换"""
+    if settings.DETERMINISTIC_ID:
+        _id = document_id(data)
+        return ReplaceOne({'_id': _id}, dict(data, _id=_id), upsert=True)
+    return ReplaceOne({'date': data['date'], 'symbol': data['symbol']}, data, upsert=True)
@@ -0,0 +1,250 @@
+# -*- coding:utf-8 -*-
+# 单进程异步引擎
+# 在一个事件循环中并发请求四个交易所的数据，数据处理交给执行器，
+# 全部交易所共用一个数据库连接写入数据
+import time
+import asyncio
+import importlib
+import multiprocessing
+import settings
+import pipeline
+import database
+import fetch
+import metrics
+import profiler
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from watermark import Tracker
+from log import Logger
+
+log = Logger('logs/engine.log')
+
+
+class Sink(object):
+    """代替爬虫数据队列，把爬虫数据交给引擎处理"""
+    def __init__(self, engine, exchange):
+        self.engine = engine
+        self.exchange = exchange
+
+    def put(self, item):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # 爬虫在线程池中处理请求结果，回到事件循环处理，数据处理跟不上时在这里等待
+            asyncio.run_coroutine_threadsafe(self.engine.submit(self.exchange, item), self.engine.loop).result()
+        else:
+            self.engine.parse(self.exchange, item)
+
+
+class AsyncEngine(object):
+    """
+    异步引擎
+    每个交易所的请求在事件循环中按日期顺序调度，同时进行的请求数由主机调度器控制，
+    请求本身使用各交易所原有的 fetch 在线程池中执行，
+    转换、存档、保存日历、创建索引等阻塞操作在爬虫线程池中执行，不占用事件循环
+    """
+    def __init__(self, exchanges=None, replay=False, gaps=False, start_date=None, end_date=None):
+        self.exchanges = exchanges or settings.EXCHANGES
+        self.replay = replay
+        self.gaps = gaps
+        # 日期范围
+        self.start_date = start_date
+        self.end_date = end_date
+        self.loop = None
+        # 请求线程池，同时进行的请求数由主机调度器控制，超过上限的线程只会在调度器中等待，
+        # 因此线程数为各主机同时进行的请求数上限之和，同一个主机的交易所共用上限
+        self.fetch_executor = ThreadPoolExecutor(
+            max_workers=fetch.host_workers(self.exchanges), thread_name_prefix='fetch')
+        # 爬虫线程池，每个交易所按顺序处理请求结果，一个交易所一个线程
+        self.crawl_executor = ThreadPoolExecutor(max_workers=len(self.exchanges), thread_name_prefix='crawl')
+        processes = pipeline.parse_processes()
+        # 在子进程中处理数据时，处理耗时由主进程记录
+        self.parse_in_processes = bool(processes)
+        if processes:
+            # 使用spawn创建子进程，避免在多线程的进程中fork
+            self.parse_executor = ProcessPoolExecutor(
+                max_workers=processes, mp_context=multiprocessing.get_context('spawn'),
+                **profiler.pool_kwargs('engine'))
+        else:
+            self.parse_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='parse')
+        # 写入数据库只用一个线程，保证同一个数据表的数据按顺序写入
+        self.write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='write')
+        # 交易所 -> (成交量, 持卖单量, 持买单量) 三个数据插入对象
+        self.inserters = {}
+        # 还没有写入完成的数据处理任务
+        self.parsing = set()
+
+    def run(self):
+        """运行全部交易所，返回出错的交易所"""
+        return asyncio.run(self.main())
+
+    async def main(self):
+        self.loop = asyncio.get_running_loop()
+        metrics.gauge('queue_depth', lambda: len(self.parsing), exchange='all', queue='parsing')
+        flusher = self.loop.create_task(self.flush_periodically())
+        try:
+            results = await asyncio.gather(*[self.run_exchange(name) for name in self.exchanges],
+                                           return_exceptions=True)
+            # 等待剩余的数据处理和写入
+            while self.parsing:
+                await asyncio.wait(list(self.parsing))
+            flusher.cancel()
+            failed = []
+            for name, result in zip(self.exchanges, results):
+                if isinstance(result, Exception):
+                    log.logger.error('%s出错，错误信息：%s' % (name, result), exc_info=result)
+                    failed.append(name)
+            for inserters in self.inserters.values():
+                for inserter in inserters:
+                    await self.loop.run_in_executor(self.write_executor, inserter.close)
+            return failed
+        finally:
+            self.fetch_executor.shutdown(wait=False)
+            self.crawl_executor.shutdown(wait=True)
+            self.parse_executor.shutdown(wait=True)
+            self.write_executor.shutdown(wait=True)
+            database.close()
+
+    async def run_exchange(self, name):
+        """爬取一个交易所"""
+        start = time.time()
+        # 导入模块、读取日历和创建索引都会阻塞，放到线程池中执行
+        crawler, self.inserters[name] = await self.loop.run_in_executor(self.crawl_executor, self.setup, name)
+        try:
+            if self.replay:
+                await self.loop.run_in_executor(self.crawl_executor, crawler.replay_archive)
+            else:
+                await self.crawl(name, crawler)
+        except Exception as e:
+            crawler.error = e
+            raise
+        finally:
+            crawler.close()
+        log.logger.info('%s爬取完成，耗时%ss' % (name, time.time() - start))
+
+    def setup(self, name):
+        """创建交易所的爬虫和三个数据插入对象"""
+        module = importlib.import_module(name)
+        # 指定开始日期时与水位之间可能有没爬取的日期，不推进水位
+        tracker = Tracker() if self.start_date is None else None
+        crawler = module.CrawlData(Sink(self, name), self.replay, tracker, self.gaps, self.start_date, self.end_date)
+        inserters = [
+            pipeline.Inserter(name, None, settings.COLLECTION_NAMES[key], crawler.logger, tracker)
+            for key in ('TRADE', 'SHORT', 'LONG')
+        ]
+        return crawler, inserters
+
+    async def crawl(self, name, crawler):
+        """按顺序处理请求结果，失败的任务在本轮结束后重试"""
+        # 需要查询数据库，放到线程池中执行
+        tasks = await self.loop.run_in_executor(self.crawl_executor, lambda: list(crawler.tasks()))
+        try:
+            while tasks:
+                await self.fetch_all(name, crawler, tasks)
+                tasks = crawler.retry_tasks()
+                if tasks:
+                    log.logger.warning('%s有%s个任务请求失败，%s秒后重试' % (name, len(tasks), settings.RETRY_DELAY))
+                    await asyncio.sleep(settings.RETRY_DELAY)
+            for task in sorted(crawler.deferred):
+                log.logger.error('%s多次重试仍然失败，放弃 %s' % (name, task))
+        finally:
+            # 保存交易日历
+            await self.loop.run_in_executor(self.crawl_executor, crawler.finish)
+
+    async def fetch_all(self, name, crawler, tasks):
+        """同时进行的请求不超过交易所的请求数上限，实际请求数由主机调度器控制"""
+        workers = fetch.max_workers(name)
+        pending = deque()
+        try:
+            for task in tasks:
+                pending.append((task, self.loop.run_in_executor(self.fetch_executor, crawler.fetch, task)))
+                if len(pending) < workers:
+                    continue
+                task, future = pending.popleft()
+                await self.settle(crawler, task, await future)
+                await self.throttle()
+            while pending:
+                task, future = pending.popleft()
+                await self.settle(crawler, task, await future)
+        finally:
+            # 出错结束时取消还没开始的请求
+            for _, future in pending:
+                future.cancel()
+
+    async def settle(self, crawler, task, content):
+        """在爬虫线程池中转换数据、保存存档，再放进数据处理"""
+        await self.loop.run_in_executor(self.crawl_executor, crawler.settle, task, content)
+
+    async def throttle(self):
+        """数据处理跟不上时暂停请求，避免原始数据堆积在内存中"""
+        limit = settings.QUEUE_SIZE.get('crawl', 0)
+        while limit and len(self.parsing) >= limit:
+            await asyncio.wait(list(self.parsing), return_when=asyncio.FIRST_COMPLETED)
+
+    async def submit(self, name, item):
+        await self.throttle()
+        self.parse(name, item)
+
+    def parse(self, name, item):
+        """在事件循环中创建数据处理任务"""
+        task = self.loop.create_task(self.parse_and_write(name, item))
+        self.parsing.add(task)
+        task.add_done_callback(self.parsing.discard)
+
+    async def parse_and_write(self, name, item):
+        """在执行器中处理数据，再交给写入线程"""
+        try:
+            *results, elapsed = await self.loop.run_in_executor(self.parse_executor, pipeline.parse_item, name, item)
+        except Exception as e:
+            log.logger.error('数据处理出错, 交易所：%s，时间：%s，错误信息：%s' % (name, item[0], e), exc_info=True)
+            # 当天的数据不完整，水位不越过这一天
+            results = [[pipeline.DayDone(item[0], failed=True)]] * 3
+            elapsed = None
+        if self.parse_in_processes and elapsed is not None:
+            metrics.observe('parse_seconds', elapsed, exchange=name)
+        for inserter, docs in zip(self.inserters[name], results):
+            await self.loop.run_in_executor(self.write_executor, self.write, inserter, docs)
+
+    async def flush_periodically(self):
+        """定期写入等待时间超过刷新间隔的数据"""
+        while True:
+            await asyncio.sleep(settings.INSERT_FLUSH_INTERVAL)
+            await self.loop.run_in_executor(self.write_executor, self.flush_due)
+
+    def flush_due(self):
+        for inserters in list(self.inserters.values()):
+            for inserter in inserters:
+                if inserter.timeout() == 0:
+                    inserter.flush()
+
+    @staticmethod
+    def write(inserter, docs):
+        """把数据交给数据插入对象，达到批量大小时写入"""
+        for doc in docs:
+            inserter.handle(doc)
+
+
+def main(exchanges=None, replay=False, gaps=False, profile=False, start_date=None, end_date=None):
+    start = time.time()
+    log.logger.info('-'*50+' start '+'-'*50)
+    log.logger.info('开始期货大户持仓爬虫程序（异步引擎）')
+    exporter = metrics.Exporter('engine')
+    exporter.start()
+    # 性能采样
+    sampler = profiler.Sampler('engine') if profile else None
+    if sampler:
+        sampler.start()
+    try:
+        failed = AsyncEngine(exchanges, replay, gaps, start_date, end_date).run()
+    finally:
+        exporter.stop(log.logger)
+        if sampler:
+            sampler.stop(log.logger)
+    if failed:
+        log.logger.error('以下交易所没有更新完成: %s' % ', '.join(failed))
+    else:
+        log.logger.info('期货大户持仓数据已更新完成')
+    log.logger.info('共耗时%ss' % (time.time()-start))
+    log.logger.info('-'*50+'  end  '+'-'*50)
+    return failed
@@ -0,0 +1,284 @@
+# -*- coding:utf-8 -*-
+# 并发请求工具
+import time
+import random
+import threading
+import requests
+import settings
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout, wait, FIRST_COMPLETED
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+
+
+def ordered_map(func, items, workers):
+    """
+    使用线程池并发执行func，并按照items的顺序返回结果
+    :param func: 对每个item执行的函数
+    :param items: 可迭代对象，按需读取，不会一次性全部提交
+    :param workers: 同时执行的最大任务数
+    :return : 生成器，依次返回 (item, 结果)
+    """
+    workers = max(1, workers)
+    executor = ThreadPoolExecutor(max_workers=workers)
+    # 已提交但还没返回的任务，最多保留 workers*2 个，保证线程池一直有任务可做
+    pending = deque()
+    try:
+        for item in items:
+            pending.append((item, executor.submit(func, item)))
+            if len(pending) >= workers * 2:
+                item, future = pending.popleft()
+                yield item, future.result()
+        while pending:
+            item, future = pending.popleft()
+            yield item, future.result()
+    finally:
+        # 如果提前退出，取消还没开始执行的任务
+        for _, future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def max_workers(exchange):
+    """
+    交易所最多同时进行的请求数，不超过 CONCURRENCY 和主机的 MAX_CONCURRENCY，
+    实际的请求数由调度器在此范围内调整
+    """
+    return max(1, min(settings.CONCURRENCY[exchange], settings.SCHEDULE['MAX_CONCURRENCY']))
+
+
+def host_workers(exchanges):
+    """几个交易所所在主机最多同时进行的请求数之和，同一个主机的交易所共用调度器"""
+    return sum(scheduler.max_concurrency for scheduler in {get_scheduler(name) for name in exchanges})
+
+
+def get_timeout(exchange):
+    """交易所请求的 (连接超时, 读取超时)"""
+    return settings.TIMEOUT.get(exchange, settings.TIMEOUT['default'])
+
+
+def is_throttled(response):
+    """是否被限流或服务器出错，这种情况需要稍后重试"""
+    return response.status_code == 429 or response.status_code >= 500
+
+
+class HostScheduler(object):
+    """
+    一个主机的请求调度
+    使用令牌桶限制请求速率，同时进行的请求数从上限开始，在 1 和上限之间自适应调整：
+    请求出错或响应慢时减半，正常时逐步增加，上限不超过 MAX_CONCURRENCY；
+    开启对冲时，请求时间超过最近请求时间的分位数后再发出一个相同的请求，使用先返回的结果，
+    对冲请求同样占用令牌和请求名额，没有时不对冲
+    """
+    def __init__(self, concurrency):
+        """
+        :param concurrency: 该主机上各交易所的 CONCURRENCY 之和
+        """
+        self.rate = settings.SCHEDULE['RATE']
+        self.burst = max(1, settings.SCHEDULE['BURST'])
+        self.max_concurrency = max(1, min(settings.SCHEDULE['MAX_CONCURRENCY'], concurrency))
+        self.slow = settings.SCHEDULE['SLOW']
+        # 令牌数
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        # 当前允许同时进行的请求数
+        self.limit = float(self.max_concurrency)
+        # 正在进行的请求数
+        self.active = 0
+        # 上次减少请求数的时间，同一批请求一起出错时只减少一次
+        self.decreased = 0
+        # 最近成功请求的耗时
+        self.latencies = deque(maxlen=settings.HEDGE['WINDOW'])
+        # 发出的对冲请求数
+        self.hedges = 0
+        # 对冲时执行请求的线程池，每个请求名额最多同时有原请求和对冲请求两个线程
+        self.hedge_executor = ThreadPoolExecutor(max_workers=self.max_concurrency * 2)
+        self._cond = threading.Condition()
+
+    def refill(self, now):
+        """按经过的时间补充令牌，在锁内调用"""
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """等待令牌和请求名额，返回开始时间"""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self.refill(now)
+                if self.active < int(self.limit):
+                    if not self.rate or self.tokens >= 1:
+                        self.tokens -= 1
+                        self.active += 1
+                        return now
+                    # 等到有新的令牌
+                    self._cond.wait((1 - self.tokens) / self.rate)
+                else:
+                    self._cond.wait()
+
+    def try_acquire(self):
+        """不等待，有令牌和请求名额时占用并返回True"""
+        with self._cond:
+            self.refill(time.monotonic())
+            if self.active < int(self.limit) and (not self.rate or self.tokens >= 1):
+                self.tokens -= 1
+                self.active += 1
+                return True
+            return False
+
+    def free(self):
+        """释放一个请求名额，不调整同时进行的请求数"""
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    def release(self, start, ok):
+        """请求结束，根据结果和响应时间调整同时进行的请求数"""
+        now = time.monotonic()
+        with self._cond:
+            self.active -= 1
+            if ok:
+                self.latencies.append(now - start)
+            if not ok or now - start > self.slow:
+                if now - self.decreased > self.slow:
+                    self.limit = max(1.0, self.limit / 2)
+                    self.decreased = now
+            else:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    def call(self, func, *args, **kwargs):
+        """
+        按调度执行一次请求，返回 func 的返回值
+        func 出错、被限流或服务器出错时记为失败
+        """
+        start = self.acquire()
+        ok = False
+        try:
+            if settings.HEDGE['ENABLED']:
+                response = self.hedged(func, *args, **kwargs)
+            else:
+                response = func(*args, **kwargs)
+            ok = not is_throttled(response)
+            return response
+        finally:
+            self.release(start, ok)
+
+    def hedge_delay(self):
+        """发出对冲请求前等待的秒数，样本不够时返回None"""
+        with self._cond:
+            if len(self.latencies) < settings.HEDGE['MIN_SAMPLES']:
+                return None
+            latencies = sorted(self.latencies)
+        index = min(len(latencies) - 1, int(len(latencies) * settings.HEDGE['PERCENTILE'] / 100))
+        return latencies[index]
+
+    def hedged(self, func, *args, **kwargs):
+        """请求超过延迟分位数还没有返回时，再发出一个相同的请求，使用先成功返回的结果"""
+        delay = self.hedge_delay()
+        if delay is None:
+            return func(*args, **kwargs)
+        first = self.hedge_executor.submit(func, *args, **kwargs)
+        try:
+            return first.result(timeout=delay)
+        except FutureTimeout:
+            pass
+        # 没有令牌或请求名额时不对冲，继续等原请求
+        if not self.try_acquire():
+            return first.result()
+        with self._cond:
+            self.hedges += 1
+        second = self.hedge_executor.submit(func, *args, **kwargs)
+        # 原请求的名额在 call 中返回后释放，对冲请求的名额等两个请求都结束后再释放，
+        # 这样较慢的请求在结束前仍然占用一个名额
+        remaining = [2]
+        lock = threading.Lock()
+
+        def done(future):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            self.free()
+        first.add_done_callback(done)
+        second.add_done_callback(done)
+        pending = {first, second}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # 较慢的请求会在超时内结束，结果直接丢弃
+                    return future.result()
+        # 两个请求都失败
+        return first.result()
+
+    @staticmethod
+    def backoff(attempt):
+        """第 attempt 次重试前等待，时间按次数翻倍并随机抖动"""
+        delay = min(settings.SCHEDULE['MAX_BACKOFF'], settings.SCHEDULE['BACKOFF'] * 2 ** (attempt - 1))
+        time.sleep(random.uniform(0, delay))
+
+
+# 主机 -> 调度器
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(exchange):
+    """交易所所在主机的调度器，同一个主机共用"""
+    host = urlparse(settings.API[exchange]).netloc
+    with _schedulers_lock:
+        if host not in _schedulers:
+            # 主机上各交易所的请求数之和
+            concurrency = sum(settings.CONCURRENCY[name] for name, url in settings.API.items()
+                              if urlparse(url).netloc == host)
+            _schedulers[host] = HostScheduler(concurrency)
+        return _schedulers[host]
+
+
+def make_session(exchange):
+    """
+    创建交易所使用的会话，会话内的连接会被复用
+    :param exchange: 交易所代码
+    """
+    session = requests.Session()
+    # 连接池大小，至少要能容纳同时进行的请求，开启对冲时每个请求最多再占用一个连接
+    workers = max_workers(exchange)
+    if settings.HEDGE['ENABLED']:
+        workers *= 2
+    pool_size = max(settings.POOL_SIZE[exchange], workers)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    # 默认请求头
+    session.headers.update(settings.HEADERS.get('default', {}))
+    session.headers.update(settings.HEADERS.get(exchange, {}))
+    return session
+
+
+def session_stats(session):
+    """
+    统计会话的请求次数和新建的连接数
+    :return : (请求次数, 新建连接数)
+    """
+    num_requests = 0
+    num_connections = 0
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            num_requests += pool.num_requests
+            num_connections += pool.num_connections
+    return num_requests, num_connections
+
+
+def log_session_stats(logger, session, scheduler=None):
+    """把连接复用情况写到日志"""
+    num_requests, num_connections = session_stats(session)
+    logger.info('共请求%s次，新建连接%s个' % (num_requests, num_connections))
+    if scheduler is not None and scheduler.hedges:
+        logger.info('对冲请求%s次' % scheduler.hedges)
@@ -0,0 +1,46 @@
+# -*- coding:utf-8 -*-
+# 查找已有数据中缺少数据的交易日
+import datetime
+import settings
+
+
+def stored_days(collection, exchange):
+    """数据表中某个交易所有数据的日期，一次聚合查询"""
+    pipeline = [
+        {'$match': {'exchange': exchange}},
+        {'$group': {'_id': '$date'}},
+    ]
+    return {doc['_id'].date() for doc in collection.aggregate(pipeline)}
+
+
+def missing_days(db, exchange, calendar, end):
+    """
+    查找各数据表缺少数据的交易日
+    从数据表中该交易所最早的一天开始，到 end 为止（包含两端），
+    周一到周五都应该有数据，已经确认没有数据的日期不算缺少，
+    请求失败的日期没有确认过，同样算作缺少
+    :param db: 数据库
+    :param exchange: 交易所代码
+    :param calendar: 交易日历
+    :param end: 最后一天
+    :return : 按日期排序的缺少数据的交易日，任意一个数据表缺少就算缺少
+    """
+    stored = {name: stored_days(db[name], exchange) for name in settings.COLLECTION_NAMES.values()}
+    starts = [min(days) for days in stored.values() if days]
+    if not starts:
+        return []
+    missing = []
+    day = min(starts)
+    while day <= end:
+        if day.isoweekday() < 6 and not calendar.is_closed(day, exchange):
+            if any(day not in days for days in stored.values()):
+                missing.append(day)
+        day += datetime.timedelta(days=1)
+    return missing
+
+
+def log_missing_days(logger, days):
+    """把缺少数据的交易日写到日志"""
+    logger.info('发现%s个缺少数据的交易日' % len(days))
+    if days:
+        logger.info('缺少数据的交易日: %s' % ', '.join(day.strftime('%Y-%m-%d') for day in days))
@@ -1,20 +1,161 @@
 import os
 import sys
+import time
 import logging
+import threading
+import settings
 
+from queue import Queue, Empty
 from logging import FileHandler
 from logging import handlers
+from multiprocessing import util
 
 
 class MPFileLogHandler(logging.Handler):
     """重构logging的Handler类，兼容多进程"""
-    def __init__(self, file_path):
+    def __init__(self, file_path, buffered=False):
         self._fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND)
         logging.Handler.__init__(self)
+        # 缓存日志，flush时一次写入，由写日志线程调用
+        self.buffered = buffered
+        self.buffer = []
 
     def emit(self, record):
         msg = "{}\n".format(self.format(record))
-        os.write(self._fd, msg.encode('utf-8'))
+        if self.buffered:
+            self.buffer.append(msg)
+        else:
+            os.write(self._fd, msg.encode('utf-8'))
+
+    def flush(self):
+        if self.buffer:
+            # 以追加方式一次写入，多个进程的日志不会交错在一行中
+            msg, self.buffer = ''.join(self.buffer), []
+            os.write(self._fd, msg.encode('utf-8'))
+
+
+class LogWriter(threading.Thread):
+    """
+    写日志线程，每个进程一个
+    日志在队列中积累到 BATCH_SIZE 条或等待超过 FLUSH_INTERVAL 秒后批量写入，
+    相同的日志在 DUPLICATE_INTERVAL 秒内只写入一次，之后写入重复的次数
+    """
+    def __init__(self):
+        super(LogWriter, self).__init__(daemon=True)
+        # (日志, 处理日志的handler)
+        self.queue = Queue()
+        # 重复日志 -> [第一次写入的时间, 之后重复的次数, 日志, handler]
+        self.duplicates = {}
+        # 有待写入内容的handler
+        self.dirty = set()
+
+    def put(self, record, targets):
+        self.queue.put((record, targets))
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.time() + settings.LOG['FLUSH_INTERVAL']
+            while len(batch) < settings.LOG['BATCH_SIZE'] and batch[-1] is not None:
+                try:
+                    batch.append(self.queue.get(timeout=max(0, deadline - time.time())))
+                except Empty:
+                    break
+            for item in batch:
+                if item is not None:
+                    self.handle(*item)
+            self.expire()
+            self.flush()
+            if batch[-1] is None:
+                return
+
+    def handle(self, record, targets):
+        interval = settings.LOG['DUPLICATE_INTERVAL']
+        if interval:
+            key = (record.name, record.levelno, record.getMessage())
+            duplicate = self.duplicates.get(key)
+            if duplicate is not None and record.created - duplicate[0] < interval:
+                duplicate[1] += 1
+                return
+            if duplicate is not None:
+                self.summarize(duplicate)
+            self.duplicates[key] = [record.created, 0, record, targets]
+        self.emit(record, targets)
+
+    def emit(self, record, targets):
+        for handler in targets:
+            # 与logging中一样，按handler的级别过滤
+            if record.levelno >= handler.level:
+                handler.handle(record)
+                self.dirty.add(handler)
+
+    def summarize(self, duplicate):
+        """写入重复日志的次数"""
+        first, count, record, targets = duplicate
+        if count:
+            summary = logging.makeLogRecord(dict(
+                record.__dict__, msg='%s（%s秒内重复%s次）' % (record.getMessage(), settings.LOG['DUPLICATE_INTERVAL'], count),
+                args=None, exc_info=None, exc_text=None, created=time.time()))
+            self.emit(summary, targets)
+
+    def expire(self, everything=False):
+        """写入已经超过时间的重复日志次数"""
+        now = time.time()
+        for key, duplicate in list(self.duplicates.items()):
+            if everything or now - duplicate[0] >= settings.LOG['DUPLICATE_INTERVAL']:
+                self.summarize(duplicate)
+                del self.duplicates[key]
+
+    def flush(self):
+        for handler in self.dirty:
+            try:
+                handler.flush()
+            except Exception:
+                pass
+        self.dirty = set()
+
+    def close(self):
+        """写入队列中剩余的日志，进程退出时调用"""
+        self.queue.put(None)
+        self.join()
+        self.expire(everything=True)
+        self.flush()
+
+
+# 当前进程的写日志线程
+_writer = None
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """当前进程的写日志线程，子进程中第一次使用时创建"""
+    global _writer, _writer_pid
+    with _writer_lock:
+        if _writer_pid != os.getpid():
+            _writer = LogWriter()
+            _writer_pid = os.getpid()
+            _writer.start()
+            # 进程退出时写入剩余的日志，multiprocessing 的子进程退出时不会调用 atexit
+            util.Finalize(None, _writer.close, exitpriority=-100)
+        return _writer
+
+
+class AsyncLogHandler(logging.Handler):
+    """把日志放进写日志线程的队列，调用日志的线程不等待写入"""
+    def __init__(self, targets):
+        logging.Handler.__init__(self)
+        # 实际写入日志的handler，在写日志线程中调用
+        self.targets = tuple(targets)
+
+    def emit(self, record):
+        try:
+            # 在调用线程中生成消息，参数之后可能被修改；异常信息由写日志线程格式化
+            record.msg = record.getMessage()
+            record.args = None
+            get_writer().put(record, self.targets)
+        except Exception:
+            self.handleError(record)
 
 
 
@@ -27,7 +168,7 @@ class Logger(object):
         'crit':logging.CRITICAL
     }#日志级别关系映射
 
-    def __init__(self, filename, filepath=None, level='debug', when='D', backCount=3, fmt='%(asctime)s - %(filename)s[line:%(lineno)d] - %(levelname)s: %(message)s'):
+    def __init__(self, filename, filepath=None, level='debug', when='D', backCount=3, fmt='%(asctime)s - %(filename)s[line:%(lineno)d] - %(levelname)s: %(message)s', asynchronous=None):
         # 设置日志默认路径
         if not filepath:
             filepath=os.path.join(sys.path[0], filename)
@@ -44,8 +185,11 @@ class Logger(object):
             sh.setFormatter(format_str)
             # 设置等级
             sh.setLevel(self.level_relations.get('debug'))
+            # 异步写入，默认使用配置
+            if asynchronous is None:
+                asynchronous = settings.LOG['ASYNC']
             # 多进程处理
-            wh = MPFileLogHandler(filepath)
+            wh = MPFileLogHandler(filepath, buffered=asynchronous)
             # 设置输出格式
             wh.setFormatter(format_str)
             wh.setLevel(self.level_relations.get('info'))
@@ -63,8 +207,12 @@ class Logger(object):
             # 设置文件里写入的格式
             # th.setFormatter(format_str)
             # 把对象加到logger里
-            self.logger.addHandler(sh)
-            self.logger.addHandler(wh)
+            if asynchronous:
+                # 由写日志线程批量写入
+                self.logger.addHandler(AsyncLogHandler([sh, wh]))
+            else:
+                self.logger.addHandler(sh)
+                self.logger.addHandler(wh)
             # self.logger.addHandler(th)
 
 
@@ -0,0 +1,247 @@
+# -*- coding:utf-8 -*-
+# 运行指标
+# 计数器和直方图按交易所等标签区分，运行中导出为 Prometheus 文本格式（文本文件或本地端口），
+# 运行结束时输出 JSON 汇总
+import os
+import sys
+import json
+import time
+import bisect
+import threading
+import settings
+
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# 指标名前缀
+PREFIX = 'future_rank_'
+
+# 指标名 -> (类型, 说明)
+DEFINITIONS = {
+    'fetch_seconds': ('histogram', 'Request latency in seconds'),
+    'fetch_bytes_total': ('counter', 'Bytes downloaded'),
+    'fetch_errors_total': ('counter', 'Requests that raised an exception'),
+    'parse_seconds': ('histogram', 'Time to parse one payload in seconds'),
+    'documents_total': ('counter', 'Documents emitted per collection'),
+    'insert_seconds': ('histogram', 'Bulk insert latency in seconds'),
+    'queue_depth': ('gauge', 'Current queue length'),
+    'queue_high_water': ('gauge', 'Maximum queue length'),
+}
+
+# 直方图的分桶上限（秒）
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram(object):
+    """直方图，记录各分桶的次数以及总次数、总和和最大值"""
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(BUCKETS, value)
+        if index < len(BUCKETS):
+            self.buckets[index] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+
+class Registry(object):
+    """进程内的全部指标"""
+    def __init__(self):
+        # (指标名, 标签) -> 计数器的值或直方图
+        self.values = {}
+        # (指标名, 标签) -> 读取当前值的函数
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self.values:
+                self.values[key] = Histogram()
+            self.values[key].observe(value)
+
+    def gauge(self, name, func, **labels):
+        with self._lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = func
+
+    def collect(self):
+        """
+        读取全部指标
+        :return : {指标名: [(标签, 值)]}，直方图的值为 Histogram 的副本
+        """
+        metrics = {}
+        with self._lock:
+            for (name, labels), value in sorted(self.values.items()):
+                if isinstance(value, Histogram):
+                    copy = Histogram()
+                    copy.__dict__.update(value.__dict__, buckets=list(value.buckets))
+                    value = copy
+                metrics.setdefault(name, []).append((labels, value))
+            gauges = sorted(self.gauges.items())
+        for (name, labels), func in gauges:
+            metrics.setdefault(name, []).append((labels, func()))
+        return metrics
+
+
+registry = Registry()
+
+
+def inc(name, value=1, **labels):
+    """计数器加 value"""
+    registry.inc(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    """直方图记录一个值"""
+    registry.observe(name, value, **labels)
+
+
+def gauge(name, func, **labels):
+    """登记一个导出时才读取的值"""
+    registry.gauge(name, func, **labels)
+
+
+@contextmanager
+def timer(name, **labels):
+    """把代码块的耗时记录到直方图"""
+    start = time.time()
+    try:
+        yield
+    finally:
+        registry.observe(name, time.time() - start, **labels)
+
+
+def record_fetch(exchange, response):
+    """记录一次请求的耗时和下载字节数"""
+    registry.observe('fetch_seconds', response.elapsed.total_seconds(), exchange=exchange)
+    registry.inc('fetch_bytes_total', len(response.content), exchange=exchange)
+
+
+def track_queues(exchange, queues):
+    """导出各队列的当前长度和最大长度，不包括 END"""
+    for q in queues:
+        registry.gauge('queue_depth', q.depth, exchange=exchange, queue=q.name)
+        registry.gauge('queue_high_water', lambda q=q: q.high_water, exchange=exchange, queue=q.name)
+
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (key, str(value).replace('\\', r'\\').replace('"', r'\"'))
+                             for key, value in pairs)
+
+
+def render():
+    """全部指标的 Prometheus 文本格式"""
+    lines = []
+    for name, samples in registry.collect().items():
+        kind, help_text = DEFINITIONS.get(name, ('untyped', name))
+        full_name = PREFIX + name
+        lines.append('# HELP %s %s' % (full_name, help_text))
+        lines.append('# TYPE %s %s' % (full_name, kind))
+        for labels, value in samples:
+            if isinstance(value, Histogram):
+                cumulative = 0
+                for bound, count in zip(BUCKETS, value.buckets):
+                    cumulative += count
+                    lines.append('%s_bucket%s %s' % (full_name, format_labels(labels, [('le', bound)]), cumulative))
+                lines.append('%s_bucket%s %s' % (full_name, format_labels(labels, [('le', '+Inf')]), value.count))
+                lines.append('%s_sum%s %s' % (full_name, format_labels(labels), value.sum))
+                lines.append('%s_count%s %s' % (full_name, format_labels(labels), value.count))
+            else:
+                lines.append('%s%s %s' % (full_name, format_labels(labels), value))
+    return '\n'.join(lines) + '\n'
+
+
+def summary():
+    """全部指标的汇总，直方图只保留次数、总和、平均值和最大值"""
+    result = {}
+    for name, samples in registry.collect().items():
+        items = []
+        for labels, value in samples:
+            item = dict(labels)
+            if isinstance(value, Histogram):
+                item.update(count=value.count, sum=round(value.sum, 6), max=round(value.max, 6),
+                            avg=round(value.sum / value.count, 6) if value.count else 0)
+            else:
+                item['value'] = value
+            items.append(item)
+        result[name] = items
+    return result
+
+
+def _path(template, name):
+    """配置中的路径，相对路径以程序所在目录为准"""
+    return os.path.join(sys.path[0], template.format(name=name))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # 不把每次抓取写到标准错误
+        pass
+
+
+class Exporter(threading.Thread):
+    """
+    定期把指标写到 Prometheus 文本文件，配置了端口时同时在本地端口提供指标，
+    结束时再写一次文本文件，并输出 JSON 汇总
+    """
+    def __init__(self, name):
+        super(Exporter, self).__init__(daemon=True)
+        # 交易所代码或 engine，用于文件名和端口配置
+        self.name = name
+        self.server = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        port = settings.METRICS['PORTS'].get(self.name)
+        if port:
+            self.server = ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        super(Exporter, self).start()
+
+    def run(self):
+        while not self._stopped.wait(settings.METRICS['INTERVAL']):
+            self.write_textfile()
+
+    def write_textfile(self):
+        if not settings.METRICS['TEXTFILE']:
+            return
+        path = _path(settings.METRICS['TEXTFILE'], self.name)
+        # 先写临时文件再替换，避免读到写了一半的文件
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(render())
+        os.replace(path + '.tmp', path)
+
+    def stop(self, logger):
+        """停止导出，写入最终的指标和汇总"""
+        self._stopped.set()
+        self.join()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        self.write_textfile()
+        data = summary()
+        if settings.METRICS['SUMMARY']:
+            with open(_path(settings.METRICS['SUMMARY'], self.name), 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+        logger.info('运行指标：%s' % json.dumps(data, ensure_ascii=False))
@@ -0,0 +1,775 @@
+# -*- coding:utf-8 -*-
+# 数据处理流程工具
+import os
+import time
+import datetime
+import importlib
+import multiprocessing
+import settings
+import fetch
+import gaps
+import database
+import metrics
+import profiler
+
+from threading import Thread
+from collections import deque
+from queue import Queue, Empty
+from concurrent.futures import ProcessPoolExecutor
+from pymongo.errors import BulkWriteError
+from trade_calendar import TradeCalendar
+from archive import RawArchive
+from watermark import Watermark, Tracker
+
+
+class LazyModule(object):
+    """
+    第一次使用时才导入的模块，交易所模块用它代替 import pandas、numpy
+    pandas 导入较慢，第一次处理数据时才导入，爬虫不需要等待
+    """
+    def __init__(self, name):
+        self._lazy_name = name
+
+    def __getattr__(self, attr):
+        # 只在实例上找不到属性时调用，导入后把模块的属性复制到实例上，之后不再经过这里
+        module = importlib.import_module(self._lazy_name)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+
+class _End(object):
+    """数据流结束标记"""
+    def __repr__(self):
+        return 'END'
+
+
+# 放进队列表示上游已经没有数据了
+END = _End()
+
+
+class DayDone(object):
+    """
+    放进数据队列，表示一条爬虫数据（一天，中金所为一天的一个品种）处理出的数据都已经放进队列
+    failed 为 True 时表示这条数据处理出错，当天的数据不完整，水位不能越过这一天
+    """
+    __slots__ = ('day', 'failed')
+
+    def __init__(self, day, failed=False):
+        self.day = day
+        self.failed = failed
+
+    def __repr__(self):
+        if self.failed:
+            return 'DayDone(%s, failed)' % self.day
+        return 'DayDone(%s)' % self.day
+
+
+class BoundedQueue(Queue):
+    """
+    有容量上限的队列，队列满时 put 会阻塞，让上游等待下游处理，
+    同时记录队列长度的最大值，队列长度不包括 END
+    """
+    def __init__(self, name, maxsize=None):
+        if maxsize is None:
+            maxsize = settings.QUEUE_SIZE.get(name, 0)
+        super(BoundedQueue, self).__init__(maxsize)
+        self.name = name
+        # 队列长度的最大值
+        self.high_water = 0
+        # 队列中 END 的个数
+        self.ends = 0
+
+    def _put(self, item):
+        # 在队列的锁内调用
+        super(BoundedQueue, self)._put(item)
+        if item is END:
+            self.ends += 1
+        elif len(self.queue) - self.ends > self.high_water:
+            self.high_water = len(self.queue) - self.ends
+
+    def _get(self):
+        item = super(BoundedQueue, self)._get()
+        if item is END:
+            self.ends -= 1
+        return item
+
+    def depth(self):
+        """队列中的数据条数，不包括 END"""
+        with self.mutex:
+            return len(self.queue) - self.ends
+
+
+def log_queue_stats(logger, queues):
+    """把各队列的最大长度写到日志"""
+    for q in queues:
+        logger.info('队列%s最大长度%s，容量%s' % (q.name, q.high_water, q.maxsize or '不限'))
+
+
+class Collector(list):
+    """代替数据队列，收集处理后的数据"""
+    def put(self, item):
+        self.append(item)
+
+    def docs(self):
+        """收集到的文档，不包括 DayDone"""
+        return [item for item in self if not isinstance(item, DayDone)]
+
+
+class Stage(Thread):
+    """
+    流水线中的一个阶段
+    子类实现 work()，出错时异常保存在 error 中，不论是否出错，结束时都会调用 close()
+    """
+    def __init__(self):
+        super(Stage, self).__init__()
+        self.error = None
+
+    def run(self):
+        try:
+            self.work()
+        except Exception as e:
+            self.error = e
+            self.fail()
+        finally:
+            self.close()
+
+    def work(self):
+        raise NotImplementedError
+
+    def fail(self):
+        """出错后调用"""
+        pass
+
+    def close(self):
+        """结束时调用"""
+        pass
+
+
+class Source(Stage):
+    """
+    数据源阶段，把数据按日期顺序放进队列
+    有 tracker 时登记每条数据的日期，用于推进水位
+    """
+    def __init__(self, q, tracker=None, start=None, end=None):
+        super(Source, self).__init__()
+        # 数据队列
+        self.q = q
+        self.tracker = tracker
+        # 只处理这个日期范围内的数据（包含两端），None 表示不限制
+        self.start_date = start
+        self.end_date = end
+        # 请求失败等待重试的任务 -> 日期
+        self.deferred = {}
+        # 正在重试的任务 -> 日期
+        self.retrying = {}
+        # 已经重试的轮数
+        self.rounds = 0
+
+    def tasks(self):
+        """需要请求的任务，默认为需要爬取的日期"""
+        return self.dates()
+
+    def dates(self):
+        """需要爬取的日期"""
+        raise NotImplementedError
+
+    def in_range(self, day):
+        """日期是否在指定的范围内"""
+        return (self.start_date is None or day >= self.start_date) and (self.end_date is None or day <= self.end_date)
+
+    def accept(self, task, content):
+        """处理一个任务的请求结果"""
+        raise NotImplementedError
+
+    def settle(self, task, content):
+        """处理请求结果，重试的任务处理完后不再阻挡水位"""
+        self.accept(task, content)
+        day = self.retrying.pop(task, None)
+        if day is not None and self.tracker:
+            self.tracker.release(day)
+
+    def defer(self, task, day):
+        """请求多次失败的任务，等本轮结束后再重试"""
+        if self.tracker:
+            self.tracker.hold(day)
+        self.deferred[task] = day
+
+    def retry_tasks(self):
+        """
+        取出需要重试的任务，超过 RETRY_ROUNDS 后返回空列表，失败的任务留在 deferred 中
+        """
+        if not self.deferred or self.rounds >= settings.RETRY_ROUNDS:
+            return []
+        self.rounds += 1
+        self.retrying, self.deferred = self.deferred, {}
+        return sorted(self.retrying)
+
+    def put(self, day, item):
+        """把某天的一条数据放进队列"""
+        if self.tracker:
+            self.tracker.add(day)
+        self.q.put(item)
+
+    def close(self):
+        if self.tracker:
+            # 出错结束时最后一天的数据可能没有全部放进队列
+            self.tracker.finish(self.error is None)
+
+
+class Crawler(Source):
+    """
+    交易所爬虫
+    按日期和品种并发请求，失败的任务在本轮结束后重试，有数据的原始数据保存到存档，
+    放进队列的数据为 (日期, 品种, to_item 的返回值)
+    子类设置交易所信息，实现 request 和 to_item，需要时覆盖 should_retry 和 content
+    """
+    # 交易所代码
+    exchange = None
+    # 交易所名称，用于日志
+    title = None
+    # 交易所的日志
+    logger = None
+    # 数据库中没有数据时开始爬取的日期
+    first_day = None
+    # 每天分别请求的品种，all 表示一次请求全部品种
+    products = ('all',)
+
+    def __init__(self, q, replay=False, tracker=None, gaps=False, start=None, end=None):
+        super(Crawler, self).__init__(q, tracker, start, end)
+        # 是否只爬取已有数据中缺少数据的交易日
+        self.gaps = gaps
+        # 是否从存档中读取数据
+        self.replay = replay
+        # url
+        self.url = settings.API[self.exchange]
+        # 连接失败重试次数
+        self.retry = 3
+        # 复用连接的会话
+        self.session = fetch.make_session(self.exchange)
+        # 按主机调度请求
+        self.scheduler = fetch.get_scheduler(self.exchange)
+        # 连接和读取超时
+        self.timeout = fetch.get_timeout(self.exchange)
+        # 交易日历
+        self.calendar = TradeCalendar()
+        # 原始数据存档
+        self.archive = RawArchive(self.exchange) if settings.ARCHIVE_ENABLED or replay else None
+        # 每天有数据的品种数
+        self.counts = {}
+
+    def work(self):
+        if self.replay:
+            self.replay_archive()
+            return
+        # 并发请求，按日期和品种顺序处理，失败的任务在本轮结束后重试
+        tasks = self.tasks()
+        while tasks:
+            for task, content in fetch.ordered_map(self.fetch, tasks, fetch.max_workers(self.exchange)):
+                self.settle(task, content)
+            tasks = self.retry_tasks()
+            if tasks:
+                self.logger.warning('%s个任务请求失败，%s秒后重试' % (len(tasks), settings.RETRY_DELAY))
+                time.sleep(settings.RETRY_DELAY)
+        for task in sorted(self.deferred):
+            self.logger.error('多次重试仍然失败，放弃 %s' % (task,))
+        self.finish()
+
+    def tasks(self):
+        """需要爬取的日期及品种"""
+        return [(day, product) for day in self.dates() for product in self.products]
+
+    def dates(self):
+        """需要爬取的日期"""
+        if self.gaps:
+            return self.gap_days()
+        # 查询三个表中日期最小的那天
+        last_date = self.get_last_date().date()
+        end = self.end_date or datetime.date.today()
+        # 只爬取交易日，请求失败的日期不会记为非交易日，并且会阻挡水位，下次运行时会再次请求
+        return list(self.calendar.trading_days(self.start_date or last_date, end, self.exchange))
+
+    def accept(self, task, content):
+        """处理一个品种一天的请求结果"""
+        day, product = task
+        item = None
+        if content:
+            try:
+                item = self.to_item(day, product, content)
+            except Exception as e:
+                self.logger.error('数据格式错误, 错误内容: %s, 时间: %s' % (e, day), exc_info=True)
+                content = False
+        # 多次重试仍然失败或者不能确认当天没有数据，本轮结束后重试，并阻挡水位
+        if content is False:
+            self.logger.error('获取数据失败，稍后重试 %s %s' % (day, product))
+            self.defer(task, day)
+            return
+        self.counts.setdefault(day, 0)
+        if item is not None:
+            self.counts[day] += 1
+            if self.archive:
+                self.archive.save(day, product, content)
+            # 把数据放进队列里
+            self.put(day, (day, product, item))
+
+    def finish(self):
+        """爬取结束后保存交易日历"""
+        # 当天没有爬取完整，不作记录
+        for day, _ in self.deferred:
+            self.counts.pop(day, None)
+        # 全部品种都没有数据的日期才记为没有数据
+        for day, count in self.counts.items():
+            if count:
+                self.calendar.mark_open(day)
+            else:
+                self.calendar.mark_closed(day, self.exchange)
+        self.calendar.save()
+        fetch.log_session_stats(self.logger, self.session, self.scheduler)
+
+    def replay_archive(self):
+        """
+        从存档中读取原始数据放进队列，不需要请求网络
+        读取或转换出错的数据跳过，当天不完整，水位不越过这一天
+        """
+        entries = [entry for entry in self.archive.entries()
+                   if self.in_range(datetime.datetime.strptime(entry['date'], '%Y%m%d').date())]
+        self.logger.info('从存档读取%s条数据' % len(entries))
+        for entry, content in fetch.ordered_map(self.load_entry, entries, settings.CONCURRENCY[self.exchange]):
+            day = datetime.datetime.strptime(entry['date'], '%Y%m%d').date()
+            item = None
+            if content is not None:
+                try:
+                    item = self.to_item(day, entry['product'], content)
+                except Exception as e:
+                    self.logger.error('存档数据格式错误, 错误内容: %s, 时间: %s' % (e, day), exc_info=True)
+                    content = None
+            if content is None:
+                if self.tracker:
+                    self.tracker.hold(day)
+                continue
+            if item is not None:
+                self.put(day, (day, entry['product'], item))
+
+    def load_entry(self, entry):
+        """读取一条存档的原始数据，读取出错时返回None"""
+        try:
+            return self.archive.load(entry)
+        except Exception as e:
+            self.logger.error('读取存档出错 %s %s, 错误内容: %s' % (entry['date'], entry['product'], e))
+            return None
+
+    def fetch(self, task):
+        """
+        获取某一天某个品种的数据
+        :return : 原始数据，确认没有数据返回None，多次重试失败或不能确认没有数据返回False
+        """
+        day, product = task
+        # 失败次数
+        failures = 0
+        while failures < self.retry:
+            if failures:
+                self.scheduler.backoff(failures)
+            try:
+                response = self.request(day, product)
+                metrics.record_fetch(self.exchange, response)
+            except Exception as e:
+                metrics.inc('fetch_errors_total', exchange=self.exchange)
+                self.logger.warning('获取数据超时 %s %s, 错误: %s' % (day, product, e))
+                failures += 1
+                continue
+            if self.should_retry(response):
+                self.logger.warning('请求失败 %s %s, 状态码: %s' % (day, product, response.status_code))
+                failures += 1
+                continue
+            content = self.content(response)
+            if content is False:
+                self.logger.warning('不能确认是否有数据 %s %s, 状态码: %s' % (day, product, response.status_code))
+            return content
+        return False
+
+    def request(self, day, product):
+        """通过主机调度器请求某一天某个品种的数据，返回响应"""
+        raise NotImplementedError
+
+    def should_retry(self, response):
+        """响应是否需要重试，默认在被限流或服务器出错时重试"""
+        return fetch.is_throttled(response)
+
+    def content(self, response):
+        """
+        响应中的原始数据
+        只有404说明当天没有数据，返回None，其他状态码不能确认没有数据，返回False
+        """
+        if response.status_code == 200:
+            return response.content
+        if response.status_code == 404:
+            return None
+        return False
+
+    def to_item(self, day, product, content):
+        """
+        把原始数据转换成数据处理需要的格式
+        :return : ParseData.parse_data 的参数元组，没有数据时返回None
+        """
+        raise NotImplementedError
+
+    def gap_days(self):
+        """已有数据中缺少数据的交易日，只检查到上次爬取的位置为止"""
+        end = self.get_last_date().date() - datetime.timedelta(days=1)
+        days = [day for day in gaps.missing_days(database.get_db(), self.exchange, self.calendar, end) if self.in_range(day)]
+        gaps.log_missing_days(self.logger, days)
+        return days
+
+    def get_last_date(self):
+        """获取最后一天的日期"""
+        db = database.get_db()
+        # 从已有数据中导入交易日
+        self.calendar.seed(db)
+        # 有水位时从水位的下一天开始爬取，只需要一次查询
+        marks = Watermark(db, self.exchange).load()
+        if len(marks) == len(settings.COLLECTION_NAMES):
+            return min(marks.values()) + datetime.timedelta(days=1)
+        date_list = []
+        # 对每个表进行查询最后一条的日期
+        for collection_name in settings.COLLECTION_NAMES.values():
+            collection = db[collection_name]
+            data = collection.find_one({'exchange': self.exchange}, sort=[('date', -1)])
+            if data:
+                date_list.append(data['date'])
+            else:
+                date_list.append(self.first_day)
+        # 返回最小的那天
+        return min(date_list)
+
+
+class Consumer(Stage):
+    """
+    从输入队列读取数据并处理，读到 END 后结束
+    同一个队列可以有多个消费者，读到的 END 会放回队列，让其他消费者也能结束
+    """
+    def __init__(self, q):
+        super(Consumer, self).__init__()
+        self.q = q
+
+    def work(self):
+        while True:
+            try:
+                item = self.q.get(timeout=self.timeout())
+            except Empty:
+                self.idle()
+                continue
+            if item is END:
+                self.q.put(END)
+                return
+            self.handle(item)
+
+    def fail(self):
+        # 出错后继续读取并丢弃数据，避免上游在队列满时一直等待
+        while self.q.get() is not END:
+            pass
+        self.q.put(END)
+
+    def timeout(self):
+        """等待数据的最长秒数，None 表示一直等待"""
+        return None
+
+    def idle(self):
+        """等待数据超时后调用"""
+        pass
+
+    def handle(self, item):
+        """处理一条数据"""
+        raise NotImplementedError
+
+
+class Parser(Consumer):
+    """
+    数据处理阶段，把爬虫数据转换成文档，放进成交量、持卖单量、持买单量三个数据队列
+    子类设置交易所信息，实现 parse_data
+    """
+    # 交易所代码
+    exchange = None
+    # 交易所的日志
+    logger = None
+
+    def __init__(self, q, trade_q, short_q, long_q):
+        super(Parser, self).__init__(q)
+        # 数据队列
+        self.trade_q = trade_q
+        self.short_q = short_q
+        self.long_q = long_q
+
+    def handle(self, item):
+        """处理一条爬虫数据，item 为 (日期, 品种, Crawler.to_item 的返回值)"""
+        day, product, args = item
+        try:
+            with metrics.timer('parse_seconds', exchange=self.exchange):
+                self.parse_data(*args)
+        except Exception as e:
+            self.logger.error('数据处理线程出错, 时间：%s，品种：%s，错误信息：%s' % (day, product, e), exc_info=True)
+            self.day_done(day, failed=True)
+            return
+        self.day_done(day)
+
+    def parse_data(self, *args):
+        """把一条爬虫数据转换成文档放进数据队列"""
+        raise NotImplementedError
+
+    def day_done(self, day, failed=False):
+        """一条爬虫数据已经处理完，failed 表示处理出错"""
+        for q in (self.trade_q, self.short_q, self.long_q):
+            q.put(DayDone(day, failed))
+
+
+class Inserter(Consumer):
+    """
+    数据插入阶段，批量写入一个数据表
+    有 tracker 时，一天的数据全部写入后推进该数据表的水位
+    """
+    def __init__(self, exchange, q, collection_name, logger, tracker=None):
+        super(Inserter, self).__init__(q)
+        self.exchange = exchange
+        self.collection_name = collection_name
+        self.logger = logger
+        # 记录写入情况，用于推进水位
+        self.tracker = tracker
+        # 进程内共用的数据库连接
+        self.db = database.get_db()
+        self.collection = self.db[collection_name]
+        database.ensure_index(self.collection)
+        self.watermark = Watermark(self.db, exchange)
+        # 等待批量写入的数据
+        self.batch = []
+        # 等待批量写入后才算完成的日期
+        self.days = []
+        # 本批第一条数据的时间
+        self.batch_start = time.time()
+
+    def timeout(self):
+        # 有数据等待写入时，最多等到刷新间隔
+        if self.batch:
+            return max(0, settings.INSERT_FLUSH_INTERVAL - (time.time() - self.batch_start))
+        return None
+
+    def idle(self):
+        self.flush()
+
+    def handle(self, data):
+        if isinstance(data, DayDone):
+            if data.failed:
+                # 当天的数据不完整，本次运行水位不越过这一天，下次运行时重新爬取
+                self.logger.warning('%s 的数据处理出错，%s 的水位停在前一天' % (data.day, self.collection_name))
+                if self.tracker:
+                    self.tracker.hold(data.day)
+                return
+            self.days.append(data.day)
+            # 前面的数据都已经写入时直接推进水位
+            if not self.batch:
+                self.flush()
+            return
+        if not self.batch:
+            self.batch_start = time.time()
+        self.batch.append(data)
+        metrics.inc('documents_total', exchange=self.exchange, collection=self.collection_name)
+        # 数据数量达到批量大小，或者等待时间超过刷新间隔，则写入数据库
+        if len(self.batch) >= settings.INSERT_BATCH_SIZE or time.time() - self.batch_start >= settings.INSERT_FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """写入等待中的数据，并推进水位"""
+        success = True
+        if self.batch:
+            success = self.insert_data(self.batch)
+            self.batch = []
+        if self.tracker:
+            # 写入出错后本次运行不再推进水位，下次从出错前的水位继续
+            if not success:
+                self.tracker.fail(self.collection_name)
+            for day in self.days:
+                self.tracker.done(self.collection_name, day)
+            mark = self.tracker.advance(self.collection_name)
+            if mark is not None:
+                self.watermark.update(self.collection_name, mark)
+        self.days = []
+
+    def close(self):
+        self.flush()
+
+    def insert_data(self, batch):
+        """
+        批量写入数据
+        :return : 是否全部写入成功
+        """
+        operations = [database.upsert(data) for data in batch]
+        try:
+            with metrics.timer('insert_seconds', exchange=self.exchange, collection=self.collection_name):
+                self.collection.bulk_write(operations, ordered=False)
+            return True
+        except BulkWriteError as e:
+            # 无序写入时其他数据会正常写入，只记录出错的数据
+            for error in e.details['writeErrors']:
+                data = batch[error['index']]
+                self.logger.error('插入数据出错 %s %s，错误内容：%s' % (data['symbol'], data['date'], error['errmsg']))
+        except Exception as e:
+            self.logger.error('批量插入数据出错，共%s条，错误内容：%s' % (len(batch), e), exc_info=True)
+        return False
+
+
+def run(logger, *groups):
+    """
+    启动流水线并等待全部阶段结束
+    一组阶段全部结束后，向下一组阶段的输入队列放入 END，
+    有阶段出错时，等全部阶段结束后抛出第一个异常
+    :param logger: 记录出错信息的日志
+    :param groups: 按流水线顺序排列的各组阶段，第一组为数据源
+    """
+    stages = [stage for group in groups for stage in group]
+    for stage in stages:
+        stage.start()
+    for i, group in enumerate(groups):
+        for stage in group:
+            stage.join()
+        if i + 1 < len(groups):
+            queues = []
+            for stage in groups[i + 1]:
+                if all(stage.q is not q for q in queues):
+                    queues.append(stage.q)
+            for q in queues:
+                q.put(END)
+    errors = [stage for stage in stages if stage.error is not None]
+    for stage in errors:
+        logger.error('%s出错，错误信息：%s' % (type(stage).__name__, stage.error), exc_info=stage.error)
+    if errors:
+        raise errors[0].error
+
+
+def parse_item(exchange, item):
+    """
+    在子进程中处理一条原始数据
+    :param exchange: 交易所代码，同时也是模块名
+    :param item: Crawler 放进队列的数据
+    :return : (成交量数据, 持卖单量数据, 持买单量数据, 处理耗时)，
+              子进程中记录的指标不会回到主进程，由调用方记录处理耗时
+    """
+    module = importlib.import_module(exchange)
+    trade_q, short_q, long_q = Collector(), Collector(), Collector()
+    start = time.time()
+    module.ParseData(None, trade_q, short_q, long_q).handle(item)
+    return trade_q, short_q, long_q, time.time() - start
+
+
+def parse_processes():
+    """数据处理进程数，0表示不使用多进程"""
+    if settings.PARSE_PROCESSES < 0:
+        return os.cpu_count() or 1
+    return settings.PARSE_PROCESSES
+
+
+class PoolParser(Parser):
+    """使用进程池处理数据，按原始数据的顺序把结果放进队列"""
+    def __init__(self, exchange, q, trade_q, short_q, long_q, logger, processes):
+        super(PoolParser, self).__init__(q, trade_q, short_q, long_q)
+        self.exchange = exchange
+        self.logger = logger
+        self.processes = processes
+        self.executor = None
+        # 已提交但还没放进队列的任务，按提交顺序保存
+        self.pending = deque()
+
+    def work(self):
+        # 使用spawn创建子进程，避免在多线程的进程中fork
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=self.processes, mp_context=context,
+                                 **profiler.pool_kwargs(self.exchange)) as self.executor:
+            super(PoolParser, self).work()
+            while self.pending:
+                self.emit(*self.pending.popleft())
+
+    def timeout(self):
+        # 有任务在处理时定期检查是否完成
+        return 0.1 if self.pending else None
+
+    def idle(self):
+        # 把已经完成的任务按顺序放进队列
+        while self.pending and self.pending[0][1].done():
+            self.emit(*self.pending.popleft())
+
+    def handle(self, item):
+        self.pending.append((item, self.executor.submit(parse_item, self.exchange, item)))
+        self.idle()
+        # 提交的任务足够多时，等待最早的任务完成
+        while len(self.pending) >= self.processes * 2:
+            self.emit(*self.pending.popleft())
+
+    def emit(self, item, future):
+        """等待任务完成并把结果放进队列"""
+        try:
+            trade_docs, short_docs, long_docs, elapsed = future.result()
+        except Exception as e:
+            self.logger.error('数据处理进程出错, 交易所：%s，时间：%s，错误信息：%s' % (self.exchange, item[0], e), exc_info=True)
+            self.day_done(item[0], failed=True)
+            return
+        metrics.observe('parse_seconds', elapsed, exchange=self.exchange)
+        for doc in trade_docs:
+            self.trade_q.put(doc)
+        for doc in short_docs:
+            self.short_q.put(doc)
+        for doc in long_docs:
+            self.long_q.put(doc)
+
+
+def main(crawler_cls, parser_cls, threads, replay=False, gaps=False, profile=False, start_date=None, end_date=None):
+    """
+    运行一个交易所的流水线：爬虫 -> 数据处理 -> 三个数据表的数据插入
+    :param crawler_cls: 交易所的爬虫类
+    :param parser_cls: 交易所的数据处理类
+    :param threads: 不使用多进程时的数据处理线程数
+    """
+    exchange, logger = crawler_cls.exchange, crawler_cls.logger
+    start = time.time()
+    logger.info('-'*50+' start '+'-'*50)
+    logger.info('开始%s大户持仓爬虫程序' % crawler_cls.title)
+    # 爬虫数据队列
+    q = BoundedQueue('crawl')
+    # 成交量排名数据队列
+    trade_q = BoundedQueue('trade')
+    # 持卖单量排名数据队列
+    short_q = BoundedQueue('short')
+    # 持买单量排名数据队列
+    long_q = BoundedQueue('long')
+    # 记录各天数据的写入情况，用于推进水位，指定开始日期时与水位之间可能有没爬取的日期，不推进水位
+    tracker = Tracker() if start_date is None else None
+    # 爬虫
+    crawler = crawler_cls(q, replay, tracker, gaps, start_date, end_date)
+    # 数据处理
+    processes = parse_processes()
+    if processes:
+        # 使用进程池处理数据
+        parsers = [PoolParser(exchange, q, trade_q, short_q, long_q, logger, processes)]
+    else:
+        parsers = [parser_cls(q, trade_q, short_q, long_q) for _ in range(threads)]
+    # 数据插入
+    inserters = [
+        Inserter(exchange, trade_q, settings.COLLECTION_NAMES['TRADE'], logger, tracker),
+        Inserter(exchange, short_q, settings.COLLECTION_NAMES['SHORT'], logger, tracker),
+        Inserter(exchange, long_q, settings.COLLECTION_NAMES['LONG'], logger, tracker),
+    ]
+    # 运行指标
+    metrics.track_queues(exchange, [q, trade_q, short_q, long_q])
+    exporter = metrics.Exporter(exchange)
+    exporter.start()
+    # 性能采样
+    sampler = profiler.Sampler(exchange) if profile else None
+    if sampler:
+        sampler.start()
+    try:
+        # 各阶段的输入数据处理完后依次结束
+        run(logger, [crawler], parsers, inserters)
+    finally:
+        database.close()
+        exporter.stop(logger)
+        if sampler:
+            sampler.stop(logger)
+    log_queue_stats(logger, [q, trade_q, short_q, long_q])
+    logger.info('%s大户持仓数据已更新完成' % crawler_cls.title)
+    logger.info('共耗时%ss' % (time.time()-start))
+    logger.info('-'*50+'  end  '+'-'*50)
@@ -0,0 +1,137 @@
+# -*- coding:utf-8 -*-
+# 采样性能分析
+# 定期读取进程内全部线程的调用栈，按 collapsed stacks 格式（每行 调用栈 次数）保存，
+# 可以用 flamegraph.pl 或 speedscope 生成火焰图
+import os
+import re
+import sys
+import glob
+import threading
+import settings
+
+from collections import Counter
+from multiprocessing import util
+
+# 当前进程中正在运行的采样器
+_active = None
+
+
+def _path(name):
+    directory = os.path.join(sys.path[0], settings.PROFILE['DIR'])
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, '%s.collapsed' % name)
+
+
+def thread_label(thread):
+    """线程在调用栈中的名称，流水线阶段使用类名，线程池中的线程去掉序号"""
+    if type(thread).__module__ != 'threading':
+        return type(thread).__name__
+    return re.sub(r'([-_]\d+)+$', '', thread.name)
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return '%s (%s:%s)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+class Sampler(threading.Thread):
+    """
+    采样器
+    每隔 PROFILE['INTERVAL'] 秒记录一次全部线程的调用栈，调用栈以 名称;线程 开头
+    """
+    def __init__(self, name, file_name=None):
+        super(Sampler, self).__init__(daemon=True)
+        # 交易所代码或 engine
+        self.name = name
+        # 结果文件名，默认与名称相同
+        self.file_name = file_name or name
+        # 调用栈 -> 采样次数
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+
+    def start(self):
+        global _active
+        _active = self
+        super(Sampler, self).start()
+
+    def run(self):
+        while not self._stopped.wait(settings.PROFILE['INTERVAL']):
+            self.sample()
+
+    def sample(self):
+        threads = {thread.ident: thread for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == self.ident:
+                continue
+            thread = threads.get(ident)
+            labels = []
+            while frame is not None:
+                labels.append(frame_label(frame))
+                frame = frame.f_back
+            labels.append(thread_label(thread) if thread else 'unknown')
+            labels.append(self.name)
+            self.stacks[';'.join(reversed(labels))] += 1
+
+    def stop(self, logger=None):
+        """停止采样并写入结果，同时合并进程池子进程的结果"""
+        global _active
+        self._stopped.set()
+        self.join()
+        _active = None
+        stacks = Counter(self.stacks)
+        # 进程池子进程各自写入 名称-worker-进程号 文件
+        for path in glob.glob(_path('%s-worker-*' % self.file_name)):
+            stacks.update(read(path))
+            os.remove(path)
+        path = _path(self.file_name)
+        write(path, stacks)
+        if logger:
+            logger.info('性能采样%s次，结果已写入 %s' % (sum(stacks.values()), path))
+
+
+def read(path):
+    stacks = Counter()
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if stack:
+                stacks[stack] += int(count)
+    return stacks
+
+
+def write(path, stacks):
+    with open(path, 'w', encoding='utf-8') as f:
+        for stack, count in sorted(stacks.items()):
+            f.write('%s %s\n' % (stack, count))
+
+
+def _start_worker(name):
+    """进程池子进程的初始化函数，子进程退出时写入结果"""
+    # 子进程的调用栈以 名称;worker 开头，与主进程的线程区分
+    sampler = Sampler('%s;worker' % name, '%s-worker-%s' % (name, os.getpid()))
+    sampler.start()
+    util.Finalize(None, sampler.stop, exitpriority=10)
+
+
+def pool_kwargs(name):
+    """
+    创建进程池的参数，正在采样时让子进程也进行采样
+    :param name: 子进程结果合并到的采样器名称
+    """
+    if _active is None:
+        return {}
+    return {'initializer': _start_worker, 'initargs': (name,)}
+
+
+def merge(names, logger=None):
+    """把多个采样结果合并为 all.collapsed"""
+    stacks = Counter()
+    for name in names:
+        path = _path(name)
+        if os.path.exists(path):
+            stacks.update(read(path))
+    path = _path('all')
+    write(path, stacks)
+    if logger:
+        logger.info('性能采样结果已合并到 %s' % path)
+    return path
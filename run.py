@@ -1,33 +1,70 @@
+import argparse
+import datetime
+import importlib
 import multiprocessing
 import time
-import cffex
-import czce
-import dce
-import shfe
+import settings
 
 from log import Logger
 
 log = Logger('logs/run.log')
 
 
-def main():
+def run_exchange(name, **kwargs):
+    """在当前进程中导入并运行一个交易所，用到时才导入，只爬取部分交易所时不会导入其他交易所的模块"""
+    importlib.import_module(name).main(**kwargs)
+
+
+def main(exchanges=None, replay=False, gaps=False, profile=False, start_date=None, end_date=None):
     start = time.time()
+    exchanges = exchanges or settings.EXCHANGES
+    kwargs = {'replay': replay, 'gaps': gaps, 'profile': profile, 'start_date': start_date, 'end_date': end_date}
     log.logger.info('-'*50+' start '+'-'*50)
     log.logger.info('开始期货大户持仓爬虫程序')
-    process_list = [
-        multiprocessing.Process(target=cffex.main),
-        multiprocessing.Process(target=czce.main),
-        multiprocessing.Process(target=dce.main),
-        multiprocessing.Process(target=shfe.main),
-    ]
-    for p in process_list:
-        p.start()
-    for p in process_list:
-        p.join()
+    if len(exchanges) == 1:
+        # 只有一个交易所时直接在当前进程中运行
+        run_exchange(exchanges[0], **kwargs)
+    else:
+        process_list = [multiprocessing.Process(target=run_exchange, args=(name,), kwargs=kwargs) for name in exchanges]
+        for p in process_list:
+            p.start()
+        for p in process_list:
+            p.join()
+    if profile:
+        # 合并各交易所的采样结果
+        import profiler
+        profiler.merge(exchanges, log.logger)
     log.logger.info('期货大户持仓数据已更新完成')
     log.logger.info('-'*50+'  end  '+'-'*50)
     log.logger.info('共耗时%ss' % (time.time()-start))
 
 
+def parse_date(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='期货大户持仓爬虫')
+    parser.add_argument('-e', '--exchange', action='append', choices=settings.EXCHANGES, dest='exchanges',
+                        help='要爬取的交易所，可以指定多次，默认全部')
+    parser.add_argument('--start', type=parse_date,
+                        help='开始日期 YYYY-MM-DD，默认从上次爬取的位置开始；指定后本次运行不推进水位')
+    parser.add_argument('--end', type=parse_date, help='结束日期 YYYY-MM-DD，默认到今天')
+    parser.add_argument('--replay', action='store_true', help='从原始数据存档中重新处理数据，不请求网络')
+    parser.add_argument('--gaps', action='store_true', help='只爬取已有数据中缺少数据的交易日')
+    parser.add_argument('--engine', choices=['process', 'async'], default='process',
+                        help='process: 每个交易所一个进程；async: 单进程异步引擎，占用内存和连接更少')
+    parser.add_argument('--profile', action='store_true',
+                        help='对全部进程的全部线程进行采样，结果写到 PROFILE 目录，可以生成火焰图')
+    args = parser.parse_args()
+    if args.start and args.end and args.start > args.end:
+        parser.error('开始日期不能晚于结束日期')
+    # 去掉重复的交易所，保持指定的顺序
+    exchanges = list(dict.fromkeys(args.exchanges or settings.EXCHANGES))
+    kwargs = {'replay': args.replay, 'gaps': args.gaps, 'profile': args.profile,
+              'start_date': args.start, 'end_date': args.end}
+    if args.engine == 'async':
+        import engine
+        engine.main(exchanges, **kwargs)
+    else:
+        main(exchanges, **kwargs)
@@ -19,6 +19,22 @@ COLLECTION_NAMES = {
     # 持卖单量排名
     "SHORT": 'future_short_rank',
 }
+# 水位表名，记录各交易所每个表已经完整写入的最后一天
+WATERMARK_COLLECTION = 'future_rank_watermark'
+
+# 使用由合约代码和日期生成的 _id（例如 shfe_cu1905_20190412），写入时直接按主键替换，
+# 同一合约同一天也不会出现重复数据，数据表只创建按日期查询用的 (date, exchange) 索引
+# 注意：已有数据的 _id 为 ObjectId，开启后重新爬取已有的日期会写入重复数据，
+# 只在新建的数据库中开启，或者清空数据表和水位后使用 --replay 重新写入
+DETERMINISTIC_ID = False
+
+# 批量写入数据库的数据条数
+INSERT_BATCH_SIZE = 500
+# 数据在写入前最多等待的秒数
+INSERT_FLUSH_INTERVAL = 1
+
+# 全部交易所，交易所代码同时也是模块名
+EXCHANGES = ['cffex', 'czce', 'dce', 'shfe']
 
 # 各交易所排名接口
 API = {
@@ -37,9 +53,126 @@ API = {
     'cffex': 'http://www.cffex.com.cn/sj/ccpm/{year_month}/{day}/{goods}.xml',
 }
 
-# 临时下载目录
-TEMP_DOWNLOAD_DIR = './temp/download'
-# 临时解压目录
-TEMP_EXTRACT_DIR = './temp/extract'
+# 各交易所同时进行的请求数上限
+CONCURRENCY = {
+    'shfe': 4,
+    'czce': 4,
+    'dce': 4,
+    'cffex': 4,
+}
+
+# 请求超时秒数 (连接超时, 读取超时)，default 为各交易所共用
+TIMEOUT = {
+    'default': (5, 30),
+    # 大商所返回的是一天全部合约的压缩包
+    'dce': (5, 60),
+}
+
+# 对冲请求，请求时间超过最近请求时间的分位数后，再发出一个相同的请求，使用先返回的结果
+# 对冲请求同样受 SCHEDULE 的速率和同时进行的请求数限制，没有令牌或名额时不对冲
+HEDGE = {
+    'ENABLED': False,
+    # 分位数
+    'PERCENTILE': 95,
+    # 至少有多少个请求样本才开始对冲
+    'MIN_SAMPLES': 20,
+    # 统计最近多少个请求的时间
+    'WINDOW': 200,
+}
+
+# 请求调度，同一个主机的请求共用
+SCHEDULE = {
+    # 每秒最多请求数，0 表示不限制
+    'RATE': 5,
+    # 令牌桶容量，即允许连续发出的请求数
+    'BURST': 5,
+    # 同一个主机同时进行的请求数上限，各交易所还不会超过自己的 CONCURRENCY，
+    # 从上限开始，出错或响应慢时减半，正常时逐步增加回上限
+    'MAX_CONCURRENCY': 8,
+    # 响应时间超过该秒数视为响应慢
+    'SLOW': 10,
+    # 重试前等待的秒数，每次翻倍并随机抖动，最多等待 MAX_BACKOFF 秒
+    'BACKOFF': 1,
+    'MAX_BACKOFF': 60,
+}
+# 多次重试仍然失败的日期，在本轮爬取结束后再重试的轮数
+RETRY_ROUNDS = 2
+# 每轮重试前等待的秒数
+RETRY_DELAY = 30
+
+# 各交易所连接池大小，不会小于同时进行的请求数，开启对冲时不会小于请求数的两倍
+POOL_SIZE = {
+    'shfe': 4,
+    'czce': 4,
+    'dce': 4,
+    'cffex': 4,
+}
+
+# 数据处理进程数，0 表示在线程中处理，-1 表示使用全部CPU核
+PARSE_PROCESSES = 0
+
+# 各队列的容量，队列满时上游会等待，0 表示不限制
+# crawl 为爬虫原始数据队列，每条为一天（中金所为一天一个品种）的数据，其余为待写入数据库的数据队列
+QUEUE_SIZE = {
+    'crawl': 16,
+    'trade': 10000,
+    'short': 10000,
+    'long': 10000,
+}
+
+# 运行指标
+METRICS = {
+    # Prometheus 文本文件，{name} 为交易所代码，异步引擎为 engine，为空时不写入
+    'TEXTFILE': 'logs/metrics_{name}.prom',
+    # 写入文本文件的间隔秒数
+    'INTERVAL': 15,
+    # 在本地端口提供指标，{name: 端口}，例如 {'engine': 9108}，没有配置的不开启
+    'PORTS': {},
+    # 运行结束时的 JSON 汇总，为空时只写到日志
+    'SUMMARY': 'logs/metrics_{name}.json',
+}
+
+# 性能采样，使用 --profile 开启
+PROFILE = {
+    # 采样间隔秒数
+    'INTERVAL': 0.01,
+    # 结果目录，每个交易所一个 collapsed stacks 文件，run.py 结束时合并为 all.collapsed
+    # 默认在 logs/ 下，采样结果不会提交到 git
+    'DIR': 'logs/profile',
+}
+
+# 日志，ASYNC 开启时日志放进队列，由每个进程一个写日志线程批量写入，不阻塞爬虫和数据处理线程
+LOG = {
+    'ASYNC': True,
+    # 积累多少条日志写入一次
+    'BATCH_SIZE': 100,
+    # 最多等待多少秒写入一次
+    'FLUSH_INTERVAL': 1,
+    # 相同的日志在该秒数内只写入一次，之后写入重复的次数，0 表示不合并
+    'DUPLICATE_INTERVAL': 10,
+}
+
+# 请求头，default 为各交易所共用的部分
+HEADERS = {
+    'default': {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/73.0.3683.103 Safari/537.36',
+        'Connection': 'keep-alive',
+    },
+    'shfe': {
+        'Referer': 'http://www.shfe.com.cn/statements/dataview.html?paramid=delaymarket_all',
+    },
+}
+
+# 交易日历文件，四个交易所共用，首次运行时从数据库已有的数据中生成
+# 爬虫只请求交易日，确认没有数据的日期会记录到该文件中，之后不再请求；
+# 请求失败的日期不会记录，之后会重新请求
+CALENDAR_FILE = './temp/calendar.json'
+# 至少有多少个交易所确认当天没有数据，才把当天记为非交易日
+CALENDAR_CONFIRM = 2
+
+# 是否保存原始数据，保存后可以使用 --replay 重新处理而不需要请求网络
+ARCHIVE_ENABLED = False
+# 原始数据存档目录
+ARCHIVE_DIR = './temp/archive'
 
 DCE_TIME = (2004, 1, 5)
\ No newline at end of file
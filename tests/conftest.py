@@ -0,0 +1,32 @@
+# -*- coding:utf-8 -*-
+import pytest
+
+import settings
+
+# 同步写日志，进程退出时写日志线程才写入的日志会写到 pytest 已经关闭的输出上
+settings.LOG['ASYNC'] = False
+
+
+@pytest.fixture
+def db():
+    """内存中的数据库"""
+    mongomock = pytest.importorskip('mongomock')
+    return mongomock.MongoClient()['test']
+
+
+@pytest.fixture
+def mongo(db, monkeypatch):
+    """让 database 使用内存中的数据库"""
+    import database
+    database.close()
+    monkeypatch.setattr(database.pymongo, 'MongoClient', lambda **kwargs: db.client)
+    monkeypatch.setattr(settings, 'DB_NAME', db.name)
+    yield db
+    database.close()
+
+
+@pytest.fixture
+def calendar(tmp_path):
+    """不读写项目日历文件的交易日历"""
+    from trade_calendar import TradeCalendar
+    return TradeCalendar(str(tmp_path / 'calendar.json'))
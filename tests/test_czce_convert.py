@@ -0,0 +1,51 @@
+# -*- coding:utf-8 -*-
+import pytest
+
+import bench
+import czce
+from pipeline import Collector
+
+# 郑商所各时期网页格式的合成数据用例
+ERAS = [case for case, (exchange, _, _) in bench.CASES.items() if exchange == 'czce']
+
+
+class TableParser(czce.ParseData):
+    """只收集合约表格数据，不放进队列"""
+    def __init__(self):
+        super(TableParser, self).__init__(None, Collector(), Collector(), Collector())
+        self.tables = []
+
+    def parse2(self, data, info_dict):
+        self.tables.append((data, info_dict))
+
+
+@pytest.fixture(params=ERAS)
+def tables(request):
+    """一个时期的合成网页解析出的合约表格 [(表格数据, 合约信息)]"""
+    crawler = czce.CrawlData(None)
+    parser = TableParser()
+    for day, product, content in bench.synthetic_payloads(request.param, 3):
+        parser.parse_data(*crawler.to_item(day, product, content))
+    assert parser.tables
+    return parser.tables
+
+
+def test_convert_matches_pandas(tables):
+    """快速转换与 DataFrame 转换的结果一致，包括去掉空的排名"""
+    pytest.importorskip('pandas')
+    parser = TableParser()
+    for data, info_dict in tables:
+        assert parser.convert(data, info_dict) == parser.convert_pandas(data, info_dict)
+
+
+def test_convert_skips_empty_names(tables):
+    """名称为 - 的排名不写入数据"""
+    parser = TableParser()
+    skipped = 0
+    for data, info_dict in tables:
+        for i, doc in zip((1, 4, 7), parser.convert(data, info_dict)):
+            names = [row[i] for row in data[:-1]]
+            assert [item['name'] for item in doc['data']] == [name for name in names if name != '-']
+            skipped += names.count('-')
+    # 合成数据中一定有空的排名
+    assert skipped
@@ -0,0 +1,18 @@
+# -*- coding:utf-8 -*-
+import pytest
+
+import database
+import settings
+
+
+@pytest.mark.parametrize('deterministic, key', [
+    (False, [('date', 1), ('symbol', 1)]),
+    (True, [('date', 1), ('exchange', 1)]),
+])
+def test_ensure_index_keeps_date_index(mongo, monkeypatch, deterministic, key):
+    """使用确定的 _id 时仍然有按日期查询用的索引"""
+    monkeypatch.setattr(settings, 'DETERMINISTIC_ID', deterministic)
+    collection = mongo['rank']
+    database.ensure_index(collection)
+    indexes = collection.index_information()
+    assert [index['key'] for name, index in indexes.items() if name != '_id_'] == [key]
@@ -0,0 +1,83 @@
+# -*- coding:utf-8 -*-
+import threading
+
+import pytest
+
+import fetch
+import settings
+
+
+class Response(object):
+    status_code = 200
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    """开启对冲、样本已经足够的调度器，对冲延迟为 0.01 秒"""
+    monkeypatch.setitem(settings.HEDGE, 'ENABLED', True)
+    monkeypatch.setitem(settings.SCHEDULE, 'RATE', 0)
+
+    def make(concurrency):
+        scheduler = fetch.HostScheduler(concurrency)
+        scheduler.latencies.extend([0.01] * settings.HEDGE['MIN_SAMPLES'])
+        return scheduler
+    return make
+
+
+def slow_first(release):
+    """第一次调用等到 release 后才返回，之后的调用立即返回"""
+    calls = []
+
+    def func():
+        calls.append(func)
+        if len(calls) == 1:
+            release.wait(5)
+        return Response()
+    return func, calls
+
+
+def test_hedge_skipped_without_slot(scheduler):
+    """没有请求名额时不发出对冲请求"""
+    hosts = scheduler(1)
+    release = threading.Event()
+    func, calls = slow_first(release)
+    threading.Timer(0.2, release.set).start()
+    hosts.call(func)
+    assert (len(calls), hosts.hedges, hosts.active) == (1, 0, 0)
+
+
+def test_hedge_skipped_without_token(scheduler, monkeypatch):
+    """没有令牌时不发出对冲请求"""
+    monkeypatch.setitem(settings.SCHEDULE, 'RATE', 0.001)
+    monkeypatch.setitem(settings.SCHEDULE, 'BURST', 1)
+    hosts = scheduler(2)
+    release = threading.Event()
+    func, calls = slow_first(release)
+    threading.Timer(0.2, release.set).start()
+    hosts.call(func)
+    assert (len(calls), hosts.hedges) == (1, 0)
+
+
+def test_hedge_holds_slot_until_slow_request_ends(scheduler):
+    """对冲请求先返回时，较慢的原请求结束前仍然占用一个名额"""
+    hosts = scheduler(2)
+    release = threading.Event()
+    func, calls = slow_first(release)
+    hosts.call(func)
+    assert (len(calls), hosts.hedges, hosts.active) == (2, 1, 1)
+    release.set()
+    hosts.hedge_executor.shutdown(wait=True)
+    assert hosts.active == 0
+
+
+def test_exchange_concurrency_is_ceiling(monkeypatch):
+    """交易所的 CONCURRENCY 是上限，调度器逐步增加时也不会超过"""
+    monkeypatch.setitem(settings.CONCURRENCY, 'czce', 2)
+    monkeypatch.setitem(settings.SCHEDULE, 'MAX_CONCURRENCY', 8)
+    monkeypatch.setitem(settings.SCHEDULE, 'RATE', 0)
+    monkeypatch.setattr(fetch, '_schedulers', {})
+    hosts = fetch.get_scheduler('czce')
+    for _ in range(50):
+        hosts.release(hosts.acquire(), True)
+    assert (fetch.max_workers('czce'), hosts.max_concurrency, hosts.limit) == (2, 2, 2)
+    assert fetch.host_workers(['czce']) == 2
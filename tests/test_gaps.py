@@ -0,0 +1,45 @@
+# -*- coding:utf-8 -*-
+import datetime
+
+import gaps
+import settings
+
+
+def store(db, exchange, *days):
+    """在三个数据表中写入某个交易所几天的数据"""
+    for name in settings.COLLECTION_NAMES.values():
+        for day in days:
+            db[name].insert_one({'exchange': exchange, 'symbol': '%s_test' % exchange,
+                                 'date': datetime.datetime(day.year, day.month, day.day)})
+
+
+def test_hole_between_stored_days(db, calendar):
+    """两个有数据的日期之间没有数据的工作日，即使没有请求成功过，也算缺少"""
+    store(db, 'shfe', datetime.date(2019, 4, 8), datetime.date(2019, 4, 10))
+    calendar.mark_open(datetime.date(2019, 4, 8))
+    calendar.mark_open(datetime.date(2019, 4, 10))
+    assert gaps.missing_days(db, 'shfe', calendar, datetime.date(2019, 4, 10)) == [datetime.date(2019, 4, 9)]
+
+
+def test_confirmed_closed_days_and_weekends(db, calendar):
+    """交易所确认没有数据的日期和周末不算缺少"""
+    store(db, 'shfe', datetime.date(2019, 4, 4), datetime.date(2019, 4, 8))
+    calendar.mark_closed(datetime.date(2019, 4, 5), 'shfe')
+    assert gaps.missing_days(db, 'shfe', calendar, datetime.date(2019, 4, 8)) == []
+
+
+def test_other_exchange_confirmation(db, calendar):
+    """只有一个其他交易所确认没有数据时仍然算缺少，达到 CALENDAR_CONFIRM 个后不算"""
+    store(db, 'shfe', datetime.date(2019, 4, 4), datetime.date(2019, 4, 8))
+    calendar.mark_closed(datetime.date(2019, 4, 5), 'dce')
+    assert gaps.missing_days(db, 'shfe', calendar, datetime.date(2019, 4, 8)) == [datetime.date(2019, 4, 5)]
+    for exchange in ['czce', 'cffex'][:settings.CALENDAR_CONFIRM - 1]:
+        calendar.mark_closed(datetime.date(2019, 4, 5), exchange)
+    assert gaps.missing_days(db, 'shfe', calendar, datetime.date(2019, 4, 8)) == []
+
+
+def test_one_collection_missing(db, calendar):
+    """任意一个数据表缺少就算缺少"""
+    store(db, 'czce', datetime.date(2019, 4, 8), datetime.date(2019, 4, 9))
+    db[settings.COLLECTION_NAMES['LONG']].delete_many({'date': datetime.datetime(2019, 4, 9)})
+    assert gaps.missing_days(db, 'czce', calendar, datetime.date(2019, 4, 9)) == [datetime.date(2019, 4, 9)]
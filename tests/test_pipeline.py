@@ -0,0 +1,52 @@
+# -*- coding:utf-8 -*-
+import datetime
+import logging
+from concurrent.futures import Future
+
+import pipeline
+import settings
+from watermark import Tracker, Watermark
+
+DAYS = [datetime.date(2019, 4, day) for day in (8, 9, 10)]
+logger = logging.getLogger(__name__)
+
+
+def test_queue_depth_excludes_end():
+    q = pipeline.BoundedQueue('test', 0)
+    q.put(1)
+    q.put(pipeline.END)
+    q.put(pipeline.END)
+    assert (q.depth(), q.high_water) == (1, 1)
+    q.get()
+    q.get()
+    assert (q.depth(), q.high_water) == (0, 1)
+
+
+def test_pool_parser_forwards_failed_day():
+    """进程池中的任务出错时，放入出错的 DayDone"""
+    queues = [pipeline.Collector() for _ in range(3)]
+    parser = pipeline.PoolParser('czce', None, *queues, logger, 1)
+    future = Future()
+    future.set_exception(RuntimeError('worker died'))
+    parser.emit((DAYS[0], 'all', ()), future)
+    for q in queues:
+        assert [(done.day, done.failed) for done in q] == [(DAYS[0], True)]
+
+
+def test_inserter_holds_failed_day(mongo):
+    """处理出错的日期之后的数据照常写入，水位停在出错的前一天"""
+    tracker = Tracker()
+    name = settings.COLLECTION_NAMES['TRADE']
+    inserter = pipeline.Inserter('czce', None, name, logger, tracker)
+    for day in DAYS:
+        tracker.add(day)
+    tracker.finish()
+    for day in DAYS:
+        if day == DAYS[1]:
+            inserter.handle(pipeline.DayDone(day, failed=True))
+            continue
+        inserter.handle({'symbol': 'czce_test', 'date': datetime.datetime(day.year, day.month, day.day)})
+        inserter.handle(pipeline.DayDone(day))
+    inserter.close()
+    assert mongo[name].count_documents({}) == 2
+    assert Watermark(mongo, 'czce').load() == {name: datetime.datetime(2019, 4, 8)}
@@ -0,0 +1,49 @@
+# -*- coding:utf-8 -*-
+import os
+import datetime
+
+import pytest
+
+import bench
+import czce
+import pipeline
+import settings
+from archive import RawArchive
+from watermark import Watermark
+
+# 合成数据的日期为 2019-04-08 到 2019-04-12
+DAYS = [datetime.date(2019, 4, day) for day in range(8, 13)]
+
+
+@pytest.fixture
+def archive(mongo, tmp_path, monkeypatch):
+    """保存了郑商所五天合成数据的存档"""
+    monkeypatch.setattr(settings, 'ARCHIVE_DIR', str(tmp_path / 'archive'))
+    monkeypatch.setattr(settings, 'CALENDAR_FILE', str(tmp_path / 'calendar.json'))
+    monkeypatch.setattr(settings, 'PARSE_PROCESSES', 0)
+    monkeypatch.setitem(settings.METRICS, 'TEXTFILE', '')
+    monkeypatch.setitem(settings.METRICS, 'SUMMARY', '')
+    archive = RawArchive('czce')
+    for day, product, content in bench.synthetic_payloads('czce-2019', 5):
+        archive.save(day, product, content)
+    return archive
+
+
+def stored_days(db):
+    return sorted(doc.date() for doc in db[settings.COLLECTION_NAMES['TRADE']].distinct('date'))
+
+
+def test_replay_skips_bad_entries(mongo, archive, monkeypatch):
+    """存档文件缺失或数据格式错误时跳过当天，继续回放，水位不越过出错的日期"""
+    entries = {entry['date']: entry for entry in archive.entries()}
+    os.remove(archive.object_path(entries['20190409']['sha256']))
+    to_item = czce.CrawlData.to_item
+
+    def broken(self, day, product, content):
+        if day == DAYS[3]:
+            raise ValueError('broken page')
+        return to_item(self, day, product, content)
+    monkeypatch.setattr(czce.CrawlData, 'to_item', broken)
+    pipeline.main(czce.CrawlData, czce.ParseData, 1, replay=True)
+    assert stored_days(mongo) == [DAYS[0], DAYS[2], DAYS[4]]
+    assert set(Watermark(mongo, 'czce').load().values()) == {datetime.datetime(2019, 4, 8)}
@@ -0,0 +1,103 @@
+# -*- coding:utf-8 -*-
+import re
+import datetime
+
+import pytest
+import requests
+
+import bench
+import czce
+import pipeline
+import settings
+from trade_calendar import TradeCalendar
+from watermark import Watermark
+
+# 合成数据的日期为 2019-04-08 到 2019-04-12
+END = datetime.date(2019, 4, 12)
+FAILED_DAY = datetime.date(2019, 4, 10)
+
+
+class Response(object):
+    def __init__(self, status_code, content=b''):
+        self.status_code = status_code
+        self.content = content
+        self.elapsed = datetime.timedelta(seconds=0.01)
+
+
+@pytest.fixture
+def site(mongo, tmp_path, monkeypatch):
+    """不请求网络的郑商所，记录每天的请求次数，failing 中的日期返回对应的状态码"""
+    monkeypatch.setattr(settings, 'CALENDAR_FILE', str(tmp_path / 'calendar.json'))
+    monkeypatch.setattr(settings, 'ARCHIVE_ENABLED', False)
+    monkeypatch.setattr(settings, 'PARSE_PROCESSES', 0)
+    monkeypatch.setattr(settings, 'RETRY_DELAY', 0)
+    monkeypatch.setitem(settings.SCHEDULE, 'BACKOFF', 0.001)
+    monkeypatch.setitem(settings.SCHEDULE, 'MAX_BACKOFF', 0.001)
+    monkeypatch.setitem(settings.METRICS, 'TEXTFILE', '')
+    monkeypatch.setitem(settings.METRICS, 'SUMMARY', '')
+    payloads = {day: content for day, _, content in bench.synthetic_payloads('czce-2019', 5)}
+    site = {'calls': {}, 'failing': {}}
+
+    def get(session, url, **kwargs):
+        day = datetime.datetime.strptime(re.search(r'(\d{8})', url).group(1), '%Y%m%d').date()
+        site['calls'][day] = site['calls'].get(day, 0) + 1
+        if day in site['failing']:
+            return Response(site['failing'][day])
+        if day in payloads:
+            return Response(200, payloads[day])
+        return Response(404)
+    monkeypatch.setattr(requests.Session, 'get', get)
+    # 上次运行写到 2019-04-05（周五）
+    for name in settings.COLLECTION_NAMES.values():
+        Watermark(mongo, 'czce').update(name, datetime.date(2019, 4, 5))
+    return site
+
+
+def run():
+    pipeline.main(czce.CrawlData, czce.ParseData, 1, end_date=END)
+
+
+def stored_days(db):
+    return sorted(doc.date() for doc in db[settings.COLLECTION_NAMES['TRADE']].distinct('date'))
+
+
+def test_resume_retries_failed_day(mongo, site):
+    """请求失败的日期阻挡水位，不记为非交易日，下次运行时再次请求"""
+    site['failing'][FAILED_DAY] = 503
+    run()
+    assert FAILED_DAY not in stored_days(mongo)
+    assert not TradeCalendar().is_closed(FAILED_DAY, 'czce')
+    assert set(Watermark(mongo, 'czce').load().values()) == {datetime.datetime(2019, 4, 9)}
+
+    site['failing'].clear()
+    site['calls'].clear()
+    run()
+    assert site['calls'].get(FAILED_DAY) == 1
+    assert stored_days(mongo) == [datetime.date(2019, 4, day) for day in range(8, 13)]
+    assert set(Watermark(mongo, 'czce').load().values()) == {datetime.datetime(2019, 4, 12)}
+
+
+@pytest.mark.parametrize('status', [403, 400, 302])
+def test_unconfirmed_status_is_not_closed(mongo, site, status):
+    """只有404确认没有数据，其他状态码的日期不记为非交易日，并阻挡水位"""
+    site['failing'][FAILED_DAY] = status
+    run()
+    assert not TradeCalendar().is_closed(FAILED_DAY, 'czce')
+    assert set(Watermark(mongo, 'czce').load().values()) == {datetime.datetime(2019, 4, 9)}
+
+
+def test_resume_skips_closed_days(mongo, site):
+    """从水位继续时不请求已经确认没有数据的日期"""
+    holiday = datetime.date(2019, 4, 5)
+    calendar = TradeCalendar()
+    for exchange in ('czce', 'dce'):
+        calendar.mark_closed(holiday, exchange)
+    calendar.save()
+    # 上次运行写到 2019-04-04（周四），水位不会后退，先清空
+    watermark = Watermark(mongo, 'czce')
+    watermark.collection.delete_many({})
+    for name in settings.COLLECTION_NAMES.values():
+        watermark.update(name, datetime.date(2019, 4, 4))
+    run()
+    assert holiday not in site['calls']
+    assert set(Watermark(mongo, 'czce').load().values()) == {datetime.datetime(2019, 4, 12)}
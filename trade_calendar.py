@@ -0,0 +1,124 @@
+# -*- coding:utf-8 -*-
+# 交易日历，四个交易所共用
+import os
+import json
+import datetime
+import threading
+import settings
+
+
+class TradeCalendar(object):
+    """
+    交易日历
+    交易日从数据库已有的数据中获取，非交易日只从爬虫确认没有数据的日子中学习，
+    其余按周一到周五为交易日处理
+    请求失败的日期不会记为非交易日，下次运行时仍然会请求
+    """
+    def __init__(self, path=None):
+        self.path = path or settings.CALENDAR_FILE
+        # 确认有数据的日期
+        self.open_days = set()
+        # 确认没有数据的日期，以及确认过的交易所
+        self.closed_days = {}
+        # 是否已经从数据库导入过交易日
+        self.seeded = False
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """读取日历文件"""
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        self.merge(data)
+
+    def merge(self, data):
+        """合并日历数据"""
+        self.seeded = self.seeded or data.get('seeded', False)
+        self.open_days.update(self.to_date(i) for i in data.get('open', []))
+        for day, exchanges in data.get('closed', {}).items():
+            self.closed_days.setdefault(self.to_date(day), set()).update(exchanges)
+
+    def save(self):
+        """保存日历文件，先合并其他进程已经保存的数据"""
+        with self._lock:
+            if os.path.isfile(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.merge(json.load(f))
+            data = {
+                'seeded': self.seeded,
+                'open': sorted(i.strftime('%Y-%m-%d') for i in self.open_days),
+                'closed': {k.strftime('%Y-%m-%d'): sorted(v) for k, v in sorted(self.closed_days.items())},
+            }
+            dir_name = os.path.dirname(self.path)
+            if dir_name and not os.path.isdir(dir_name):
+                os.makedirs(dir_name)
+            # 先写临时文件再替换，避免写到一半被其他进程读取
+            temp_path = '%s.%s' % (self.path, os.getpid())
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(temp_path, self.path)
+
+    def seed(self, db):
+        """从数据库已有的数据导入交易日"""
+        if self.seeded:
+            return
+        for collection_name in settings.COLLECTION_NAMES.values():
+            for date in db[collection_name].distinct('date'):
+                self.open_days.add(date.date())
+        self.seeded = True
+        self.save()
+
+    def is_closed(self, day, exchange=None):
+        """
+        是否已经确认没有数据
+        :param exchange: 交易所代码，该交易所自己确认过没有数据时同样算作没有数据
+        """
+        exchanges = self.closed_days.get(day, ())
+        return len(exchanges) >= settings.CALENDAR_CONFIRM or exchange in exchanges
+
+    def is_trading_day(self, day, exchange=None):
+        """是否为交易日"""
+        if day in self.open_days:
+            return True
+        if self.is_closed(day, exchange):
+            return False
+        # 没有确认过的日期，排除周六日
+        return day.isoweekday() < 6
+
+    def next_trading_day(self, day, exchange=None):
+        """下一个交易日"""
+        day += datetime.timedelta(days=1)
+        while not self.is_trading_day(day, exchange):
+            day += datetime.timedelta(days=1)
+        return day
+
+    def trading_days(self, start, end, exchange=None):
+        """
+        start 到 end 之间（包含两端）的交易日
+        :param start: 开始日期
+        :param end: 结束日期
+        :param exchange: 交易所代码，跳过该交易所确认过没有数据的日期
+        """
+        day = start if self.is_trading_day(start, exchange) else self.next_trading_day(start, exchange)
+        while day <= end:
+            yield day
+            day = self.next_trading_day(day, exchange)
+
+    def mark_open(self, day):
+        """记录有数据的日期"""
+        with self._lock:
+            self.open_days.add(day)
+
+    def mark_closed(self, day, exchange):
+        """记录某个交易所确认没有数据的日期"""
+        # 当天的数据可能还没有发布，不作记录
+        if day >= datetime.date.today():
+            return
+        with self._lock:
+            self.closed_days.setdefault(day, set()).add(exchange)
+
+    @staticmethod
+    def to_date(value):
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
@@ -0,0 +1,123 @@
+# -*- coding:utf-8 -*-
+# 数据写入水位，记录各交易所每个数据表已经完整写入的最后一天
+import datetime
+import threading
+import settings
+
+
+class Watermark(object):
+    """
+    保存在数据库中的水位
+    每个交易所每个数据表一条记录，_id 为 交易所.数据表名
+    """
+    def __init__(self, db, exchange):
+        self.collection = db[settings.WATERMARK_COLLECTION]
+        self.exchange = exchange
+
+    def key(self, collection_name):
+        return '%s.%s' % (self.exchange, collection_name)
+
+    def load(self):
+        """
+        读取各数据表的水位
+        :return : {数据表名: 最后一天}，没有水位的数据表不在其中
+        """
+        keys = {self.key(name): name for name in settings.COLLECTION_NAMES.values()}
+        marks = {}
+        for doc in self.collection.find({'_id': {'$in': list(keys)}}):
+            marks[keys[doc['_id']]] = doc['date']
+        return marks
+
+    def update(self, collection_name, day):
+        """推进数据表的水位，不会后退"""
+        date = datetime.datetime(day.year, day.month, day.day)
+        self.collection.update_one(
+            {'_id': self.key(collection_name)},
+            {'$max': {'date': date}, '$set': {'exchange': self.exchange, 'collection': collection_name}},
+            upsert=True
+        )
+
+
+class Tracker(object):
+    """
+    记录本次运行中各天数据的写入情况
+    爬虫按日期顺序登记放进队列的每条数据，数据处理线程处理完一条数据后在数据队列中放入 DayDone，
+    数据插入线程写入 DayDone 之前的数据后调用 done，
+    某天以及之前登记的天都完整写入后，数据表的水位才会推进到这一天
+    """
+    def __init__(self):
+        # 登记过的日期，按登记顺序
+        self.days = []
+        # 日期 -> 放进队列的数据条数
+        self.counts = {}
+        # (数据表名, 日期) -> 已经写入的数据条数
+        self.done_counts = {}
+        # 日期 -> 还没有成功请求的任务数，水位不会越过这些日期
+        self.held = {}
+        # 写入出错的数据表，本次运行不再推进水位
+        self.failed = set()
+        # 数据表名 -> 已经完整写入的天数
+        self.positions = {}
+        # 爬虫是否已经正常结束
+        self.finished = False
+        self._lock = threading.Lock()
+
+    def add(self, day):
+        """登记一条放进队列的数据"""
+        with self._lock:
+            if not self.days or self.days[-1] != day:
+                self.days.append(day)
+            self.counts[day] = self.counts.get(day, 0) + 1
+
+    def hold(self, day):
+        """当天有请求失败，等待重试，水位不越过这一天"""
+        with self._lock:
+            if not self.days or self.days[-1] != day:
+                self.days.append(day)
+            self.counts.setdefault(day, 0)
+            self.held[day] = self.held.get(day, 0) + 1
+
+    def release(self, day):
+        """当天失败的请求已经重试"""
+        with self._lock:
+            self.held[day] -= 1
+            if not self.held[day]:
+                del self.held[day]
+
+    def finish(self, success=True):
+        """爬虫结束，之后不会再登记数据"""
+        with self._lock:
+            self.finished = success
+
+    def fail(self, collection_name):
+        """数据表写入出错"""
+        with self._lock:
+            self.failed.add(collection_name)
+
+    def done(self, collection_name, day):
+        """某个数据表写入了当天的一条数据"""
+        with self._lock:
+            key = (collection_name, day)
+            self.done_counts[key] = self.done_counts.get(key, 0) + 1
+
+    def advance(self, collection_name):
+        """
+        计算数据表可以推进到的水位
+        :return : 新的水位，没有变化时返回None
+        """
+        with self._lock:
+            if collection_name in self.failed:
+                return None
+            start = pos = self.positions.get(collection_name, 0)
+            while pos < len(self.days):
+                day = self.days[pos]
+                # 最后登记的一天在爬虫结束前可能还有数据没有登记
+                if pos == len(self.days) - 1 and not self.finished:
+                    break
+                if day in self.held or self.done_counts.get((collection_name, day), 0) < self.counts[day]:
+                    break
+                pos += 1
+            self.positions[collection_name] = pos
+            if pos > start:
+                return self.days[pos - 1]
+            return None